@@ -5,7 +5,8 @@ from users.models import Subscribe, User
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ['pk', 'username', 'email', 'first_name', 'last_name']
+    list_display = ['pk', 'username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count']
     search_fields = ['username', 'email']
     list_filter = ['username', 'email']
 
@@ -27,15 +28,17 @@ class RecipeAdmin(admin.ModelAdmin):
                     'author',
                     'pub_date',
                     'count_in_favorite',
+                    'in_carts_count',
                     ]
     search_fields = ['name', 'author']
     list_filter = ['name', 'author', 'tags', 'pub_date']
-    readonly_fields = ('count_in_favorite',)
+    readonly_fields = ('count_in_favorite', 'in_carts_count')
 
     def count_in_favorite(self, obj):
-        return obj.Favorite_recipe.all().count()
+        return obj.favorites_count
 
     count_in_favorite.short_description = 'кол-во раз добавления в избранное'
+    count_in_favorite.admin_order_field = 'favorites_count'
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ApiFoodgramConfig(AppConfig):
     name = 'api_foodgram'
     # app_label = 'api_foodgram'
+
+    def ready(self):
+        from . import signals  # noqa: F401
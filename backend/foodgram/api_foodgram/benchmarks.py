@@ -0,0 +1,457 @@
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_foodgram.cache import NAMESPACES, bump_cache_version
+from api_foodgram.feed import rebuild_feeds
+from api_foodgram.ingredient_index import ingredient_index
+from api_foodgram.models import (Basket, FavoriteRecipe, Ingredient,
+                                 IngredientsRecipe, Recipe, ShoppingListItem,
+                                 Tag)
+from api_foodgram.recipe_index import recipe_index
+from api_foodgram.renderers import FastJSONRenderer
+from api_foodgram.search import index_recipes
+from api_foodgram.serializers import RecipeReadSerializer, RecipeSerializer
+from api_foodgram.utils import calculate_shopping_lists
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import Subscribe, User
+
+BATCH_SIZE = 1000
+BENCH_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+BENCH_DISHES = ('Суп', 'Салат', 'Пирог', 'Омлет', 'Каша', 'Рагу', 'Плов')
+BENCH_USER_SUBSCRIPTIONS = 30
+BENCH_USER_BASKET = 25
+BENCH_USER_FAVORITES = 40
+BENCH_PANTRY_RECIPES = 5
+NO_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+}
+
+
+def batch_size():
+    """SQLite ограничивает число строк в одном INSERT, размер партии
+    для него подбирает сам Django."""
+    return None if connection.vendor == 'sqlite' else BATCH_SIZE
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга, без numpy и statistics."""
+    ordered = sorted(values)
+    index = max(int(round(percent / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def load_catalog():
+    """Заполняет справочник ингредиентов из data/ingredients.csv."""
+    if not Ingredient.objects.exists():
+        call_command('load_ingredients', stdout=io.StringIO())
+
+
+def unique_pairs(rnd, count, left, right, exclude_equal=False):
+    pairs = set()
+    attempts = count * 3
+    while len(pairs) < count and attempts:
+        attempts -= 1
+        pair = (rnd.choice(left), rnd.choice(right))
+        if exclude_equal and pair[0] == pair[1]:
+            continue
+        pairs.add(pair)
+    return pairs
+
+
+@transaction.atomic
+def seed_dataset(users, recipes, ingredients_per_recipe=8,
+                 favorites=None, baskets=None, subscriptions=None, seed=1):
+    """
+    Синтетический набор данных для замеров.
+
+    Первый созданный пользователь - "пользователь бенчмарка": у него
+    гарантированно есть подписки, избранное и список покупок.
+    По умолчанию на каждый рецепт приходится по избранному и по корзине,
+    а на каждого пользователя - по пять подписок.
+    """
+    rnd = random.Random(seed)
+    favorites = recipes if favorites is None else favorites
+    baskets = recipes if baskets is None else baskets
+    subscriptions = users * 5 if subscriptions is None else subscriptions
+
+    load_catalog()
+    tags = [Tag.objects.get_or_create(slug=slug, defaults={
+        'name': name, 'color': color})[0]
+        for name, color, slug in BENCH_TAGS]
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+
+    password = make_password(None)
+    User.objects.bulk_create(
+        (User(email=f'bench{number}@foodgram.ru',
+              username=f'bench{number}',
+              first_name='Бенч', last_name=f'Пользователь {number}',
+              password=password)
+         for number in range(users)),
+        batch_size=batch_size()
+    )
+    user_ids = list(User.objects.filter(
+        username__startswith='bench').values_list('id', flat=True))
+    Recipe.objects.bulk_create(
+        (Recipe(author_id=rnd.choice(user_ids),
+                name=f'{rnd.choice(BENCH_DISHES)} {number}',
+                text='Синтетический рецепт для замеров производительности.',
+                image='api_foodgram/media/temp.png',
+                cooking_time=rnd.randint(5, 180))
+         for number in range(recipes)),
+        batch_size=batch_size()
+    )
+    recipe_ids = list(Recipe.objects.filter(
+        author_id__in=user_ids).values_list('id', flat=True))
+
+    IngredientsRecipe.objects.bulk_create(
+        (IngredientsRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                           amount=rnd.randint(1, 500))
+         for recipe_id in recipe_ids
+         for ingredient_id in rnd.sample(ingredient_ids,
+                                         ingredients_per_recipe)),
+        batch_size=batch_size()
+    )
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+         for recipe_id in recipe_ids
+         for tag in rnd.sample(tags, rnd.randint(1, len(tags)))),
+        batch_size=batch_size()
+    )
+
+    bench_user = user_ids[0]
+    favorite_pairs = unique_pairs(rnd, favorites, user_ids, recipe_ids)
+    favorite_pairs.update((bench_user, recipe_id) for recipe_id
+                          in rnd.sample(recipe_ids, BENCH_USER_FAVORITES))
+    basket_pairs = unique_pairs(rnd, baskets, user_ids, recipe_ids)
+    basket_pairs.update((bench_user, recipe_id) for recipe_id
+                        in rnd.sample(recipe_ids, BENCH_USER_BASKET))
+    subscribe_pairs = unique_pairs(rnd, subscriptions, user_ids, user_ids,
+                                   exclude_equal=True)
+    subscribe_pairs.update((bench_user, author_id) for author_id
+                           in rnd.sample(user_ids[1:],
+                                         BENCH_USER_SUBSCRIPTIONS))
+    FavoriteRecipe.objects.bulk_create(
+        (FavoriteRecipe(user_id=user_id, recipe_id=recipe_id)
+         for user_id, recipe_id in favorite_pairs),
+        batch_size=batch_size()
+    )
+    Basket.objects.bulk_create(
+        (Basket(user_id=user_id, recipe_id=recipe_id)
+         for user_id, recipe_id in basket_pairs),
+        batch_size=batch_size()
+    )
+    Subscribe.objects.bulk_create(
+        (Subscribe(user_id=user_id, author_id=author_id)
+         for user_id, author_id in subscribe_pairs),
+        batch_size=batch_size()
+    )
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=row['user'],
+                          ingredient_id=row['ingredient_pk'],
+                          amount=row['total'],
+                          recipes_count=row['recipes'])
+         for row in calculate_shopping_lists()),
+        batch_size=batch_size()
+    )
+    call_command('rebuild_counters', stdout=io.StringIO())
+    rebuild_feeds()
+    index_recipes(recipe_ids)
+
+
+def bench_user():
+    return User.objects.filter(username__startswith='bench').order_by(
+        'id').first()
+
+
+def endpoints():
+    """
+    Замеряемые адреса API: имя сценария -> (url, от имени пользователя).
+    Списки и страница рецепта замеряются без кэша ответов (запросы к
+    базе), сценарии *_cached - с ним, после прогревочного запроса.
+    Без рецептов в базе сценарии страницы рецепта пропускаются.
+    """
+    recipe = Recipe.objects.order_by('id').values_list(
+        'id', flat=True).first()
+    details = {} if recipe is None else {
+        'recipe_detail': (f'/api/recipes/{recipe}/', True),
+        'recipe_detail_cached': (f'/api/recipes/{recipe}/', True),
+    }
+    return {
+        'recipes_list': ('/api/recipes/?limit=20', True),
+        'recipes_list_anonymous': ('/api/recipes/?limit=20', False),
+        'recipes_list_favorited': (
+            '/api/recipes/?limit=20&is_favorited=1', True),
+        'recipes_list_cached': ('/api/recipes/?limit=20', True),
+        **details,
+        'subscriptions': ('/api/users/subscriptions/?recipes_limit=3', True),
+        'ingredients_search': ('/api/ingredients/?name=сол', True),
+        'download_shopping_cart': (
+            '/api/recipes/download_shopping_cart/', True),
+        'recipes_search': ('/api/recipes/?search=пирог&limit=20', False),
+        'feed': ('/api/recipes/feed/?limit=20', True),
+        'feed_read_fanout': ('/api/recipes/feed/?limit=20', True),
+        'what_to_cook': ('/api/recipes/what_to_cook/?limit=20', False),
+    }
+
+
+def payloads():
+    """Тела POST-запросов сценариев; остальные сценарии - GET."""
+    ingredients = IngredientsRecipe.objects.filter(
+        recipe__in=Recipe.objects.order_by('id')[:BENCH_PANTRY_RECIPES]
+    ).values_list('ingredient_id', flat=True)
+    return {
+        'what_to_cook': {'ingredients': list(ingredients), 'max_missing': 6},
+    }
+
+
+def request(client, url, data=None):
+    if data is None:
+        return client.get(url)
+    return client.post(url, data, format='json')
+
+
+# настройки, с которыми выполняется сценарий: списки, страница рецепта и
+# поиск замеряются без кэша ответов; лента подписок без входящих лент -
+# все авторы считаются "популярными" и их рецепты выбираются при чтении
+ENDPOINT_SETTINGS = {
+    'recipes_list': {'CACHES': NO_CACHE},
+    'recipes_list_anonymous': {'CACHES': NO_CACHE},
+    'recipe_detail': {'CACHES': NO_CACHE},
+    'recipes_search': {'CACHES': NO_CACHE},
+    'feed_read_fanout': {'FEED_FANOUT_LIMIT': -1},
+}
+
+
+def measure(client, url, repeat, data=None):
+    """
+    Выполняет запрос repeat раз после одного прогревочного.
+
+    Возвращает число SQL-запросов (максимум по прогонам) и p50/p95
+    времени ответа в миллисекундах, включая чтение потокового ответа.
+    """
+    request(client, url, data)
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = request(client, url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise AssertionError(
+                f'{url} вернул статус {response.status_code}')
+        queries = max(queries, len(context.captured_queries))
+    return {
+        'queries': queries,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+    }
+
+
+def run_benchmarks(repeat, only=None):
+    ingredient_index.build()
+    recipe_index.build()
+    bump_cache_version(*NAMESPACES)
+    client = APIClient()
+    client.force_authenticate(bench_user())
+    anonymous = APIClient()
+    data = payloads()
+    results = {}
+    for name, (url, authenticated) in endpoints().items():
+        if only and name not in only:
+            continue
+        with override_settings(**ENDPOINT_SETTINGS.get(name, {})):
+            results[name] = measure(
+                client if authenticated else anonymous, url, repeat,
+                data.get(name))
+    return results
+
+
+def compare_serializers(page_size=100, repeat=20):
+    """
+    Сериализует страницу рецептов пользователя бенчмарка через
+    RecipeSerializer и RecipeReadSerializer: проверяет, что JSON
+    совпадает байт в байт, и возвращает p50 процессорного времени
+    сериализации страницы в миллисекундах для каждого.
+    """
+    user = bench_user()
+    request = APIRequestFactory().get('/api/recipes/')
+    request.user = user
+    context = {'request': Request(request)}
+    page = list(Recipe.objects.with_related().with_user_flags(user)[
+        :page_size])
+    renderer = JSONRenderer()
+    outputs, timings = {}, {}
+    for serializer_class in (RecipeSerializer, RecipeReadSerializer):
+        name = serializer_class.__name__
+        samples = []
+        for _ in range(repeat):
+            start = time.process_time()
+            data = serializer_class(page, many=True, context=context).data
+            samples.append((time.process_time() - start) * 1000)
+        outputs[name] = renderer.render(data)
+        timings[name] = round(percentile(samples, 50), 3)
+    if outputs['RecipeSerializer'] != outputs['RecipeReadSerializer']:
+        raise AssertionError('RecipeReadSerializer отдает другой JSON')
+    return timings
+
+
+def compare_renderers(page_size=100, repeat=20):
+    """
+    Рендерит ответ со страницей рецептов через JSONRenderer DRF и
+    FastJSONRenderer: возвращает для каждого размер тела, размер после
+    gzip и p50 времени рендеринга в миллисекундах.
+    """
+    user = bench_user()
+    request = APIRequestFactory().get('/api/recipes/')
+    request.user = user
+    page = Recipe.objects.with_related().with_user_flags(user)[:page_size]
+    data = {'count': page_size, 'next': None, 'previous': None,
+            'results': RecipeReadSerializer(
+                page, many=True, context={'request': Request(request)}
+            ).data}
+    results = {}
+    for renderer in (JSONRenderer(), FastJSONRenderer()):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = renderer.render(data)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[type(renderer).__name__] = {
+            'bytes': len(body),
+            'gzip_bytes': len(compress_string(body)),
+            'p50_ms': round(percentile(samples, 50), 3),
+        }
+    return results
+
+
+def compare_connections(repeat=50):
+    """
+    p50 времени запроса страницы рецептов в миллисекундах с новым
+    соединением с базой на каждый запрос (как при CONN_MAX_AGE=0) и с
+    постоянным соединением, а также p50 самого подключения. С пулом
+    api_foodgram.db новое соединение берется из пула.
+    """
+    client = APIClient()
+    client.force_authenticate(bench_user())
+    url = '/api/recipes/?limit=10'
+    results = {}
+    with override_settings(CACHES=NO_CACHE):
+        request(client, url)
+        for name, reconnect in (('new_connection', True),
+                                ('persistent', False)):
+            samples = []
+            for _ in range(repeat):
+                if reconnect:
+                    connection.close()
+                start = time.perf_counter()
+                response = request(client, url)
+                samples.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise AssertionError(
+                        f'{url} вернул статус {response.status_code}')
+            results[name] = round(percentile(samples, 50), 3)
+    samples = []
+    for _ in range(repeat):
+        connection.close()
+        start = time.perf_counter()
+        connection.ensure_connection()
+        samples.append((time.perf_counter() - start) * 1000)
+    results['connect'] = round(percentile(samples, 50), 3)
+    return results
+
+
+def fire(method, url, user, workers):
+    """
+    Отправляет workers одинаковых запросов одновременно из разных
+    потоков (у каждого свое соединение с базой); возвращает статусы.
+    """
+    barrier = threading.Barrier(workers)
+
+    def send():
+        client = APIClient()
+        client.force_authenticate(user)
+        barrier.wait()
+        try:
+            return getattr(client, method)(url).status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(send) for _ in range(workers)]
+        return sorted(future.result() for future in futures)
+
+
+def race_toggles(workers=8):
+    """
+    Параллельные добавления и удаления одного рецепта в избранном и
+    корзине и одной подписки: в каждой волне ровно один запрос должен
+    пройти (201 или 204), остальные получить 400, а счетчики - сойтись
+    с rebuild_counters --verify. Возвращает {сценарий: статусы}.
+    """
+    user = bench_user()
+    recipe = Recipe.objects.exclude(
+        id__in=FavoriteRecipe.objects.filter(user=user).values('recipe')
+    ).exclude(
+        id__in=Basket.objects.filter(user=user).values('recipe')
+    ).values_list('id', flat=True).first()
+    author = User.objects.exclude(id=user.id).exclude(
+        id__in=Subscribe.objects.filter(user=user).values('author')
+    ).values_list('id', flat=True).first()
+    if recipe is None or author is None:
+        raise ValueError('Нет данных для проверки: нужен рецепт не в '
+                         'избранном и не в корзине и автор без подписки')
+    results = {}
+    for name, url in (
+        ('favorite', f'/api/recipes/{recipe}/favorite/'),
+        ('shopping_cart', f'/api/recipes/{recipe}/shopping_cart/'),
+        ('subscribe', f'/api/users/{author}/subscribe/'),
+    ):
+        for method, success in (('post', 201), ('delete', 204)):
+            statuses = fire(method, url, user, workers)
+            results[f'{name} {method.upper()}'] = statuses
+            if statuses != [success] + [400] * (workers - 1):
+                raise AssertionError(f'{name} {method.upper()}: {statuses}')
+    call_command('rebuild_counters', verify=True, stdout=io.StringIO())
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Сравнивает замеры со сценариями базовой линии.
+
+    Возвращает регрессии - рост числа запросов, он не зависит от машины
+    и шума, - и замедления: рост p95 больше чем на tolerance (доля от
+    базового значения).
+    """
+    regressions, slowdowns = [], []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(
+                f'{name}: запросов {result["queries"]}, '
+                f'в базовой линии {expected["queries"]}')
+        limit = expected['p95_ms'] * (1 + tolerance)
+        if result['p95_ms'] > limit:
+            slowdowns.append(
+                f'{name}: p95 {result["p95_ms"]} мс, '
+                f'в базовой линии {expected["p95_ms"]} мс')
+    return regressions, slowdowns
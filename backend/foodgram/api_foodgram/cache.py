@@ -0,0 +1,178 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from users.models import Subscribe
+
+from .metrics import RESPONSE_CACHE, metric_samples
+from .models import Basket, FavoriteRecipe
+from .pagination import KeysetPagination
+
+NAMESPACES = ('recipes', 'tags', 'ingredients')
+VERSION_KEY = 'response-cache:version:{}'
+
+
+def cache_version(namespace):
+    """
+    Версия пространства ключей - время последнего изменения в
+    наносекундах. Если версия пропала из кэша, берется текущее время,
+    поэтому старые записи не оживают.
+    """
+    key = VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            return cache.get(key, version)
+    return version
+
+
+def bump_cache_version(*namespaces):
+    for namespace in namespaces:
+        key = VERSION_KEY.format(namespace)
+        version = cache.get(key) or 0
+        cache.set(key, max(time.time_ns(), version + 1), None)
+
+
+def count(namespace, result):
+    """Попадание или промах - счетчик Prometheus, без записи в кэш на
+    каждый запрос."""
+    RESPONSE_CACHE.labels(namespace, result).inc()
+
+
+def response_cache_stats():
+    """
+    {пространство: {'hit': n, 'miss': n}} по счетчику
+    foodgram_response_cache_requests всех воркеров gunicorn.
+    """
+    stats = {namespace: {'hit': 0, 'miss': 0} for namespace in NAMESPACES}
+    for labels, value in metric_samples(
+            'foodgram_response_cache_requests_total'):
+        stats.setdefault(labels['namespace'], {'hit': 0, 'miss': 0})[
+            labels['result']] += int(value)
+    return stats
+
+
+def request_cache_key(request, namespace, version):
+    """
+    Ключ из хоста, пути и отсортированных параметров запроса. Пустые
+    параметры не учитываются, кроме ?cursor=: он включает постраничный
+    вывод по курсору с другим форматом ответа.
+    """
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in sorted(values)
+        if value != '' or name == KeysetPagination.cursor_query_param
+    )
+    raw = f'{request.get_host()}{request.path}?{params}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'response-cache:{namespace}:{version}:{digest}'
+
+
+def user_flags_namespace(user_id):
+    return f'user-flags:{user_id}'
+
+
+def user_flags(request):
+    """
+    Множества id избранных рецептов, рецептов в корзине и авторов в
+    подписках request.user. Хранятся в кэше под версией пользователя,
+    которую сигналы увеличивают при изменении избранного, корзины и
+    подписок, и загружаются один раз за запрос: personal_version() и
+    personalize() получают один и тот же результат.
+    """
+    flags = getattr(request, '_user_flags', None)
+    if flags is not None:
+        return flags
+    user = request.user
+    version = cache_version(user_flags_namespace(user.id))
+    key = f'response-cache:user-flags:{user.id}:{version}'
+    flags = cache.get(key)
+    if flags is None:
+        flags = {
+            'version': version,
+            'favorites': set(FavoriteRecipe.objects.filter(
+                user=user).values_list('recipe_id', flat=True)),
+            'cart': set(Basket.objects.filter(
+                user=user).values_list('recipe_id', flat=True)),
+            'subscriptions': set(Subscribe.objects.filter(
+                user=user).values_list('author_id', flat=True)),
+        }
+        cache.set(key, flags, settings.RESPONSE_CACHE_TIMEOUT)
+    request._user_flags = flags
+    return flags
+
+
+class CachedResponseMixin:
+    """
+    Кэширует ответы list/retrieve для анонимных пользователей.
+
+    Ключ включает версию cache_namespace, которую сигналы моделей
+    увеличивают при любых изменениях (api_foodgram.signals), так что
+    устаревшие записи просто перестают читаться. Ответ получает ETag и
+    Last-Modified и на условный GET отвечает 304 без обращения к базе.
+
+    Представление может отдавать из кэша и авторизованным
+    пользователям: тогда кэшируется общий ответ, построенный как для
+    анонима (shared_response = True), а personalize() накладывает на
+    его копию данные пользователя с версией personal_version().
+    """
+    cache_namespace = None
+    shared_response = False
+
+    def is_cacheable(self, request):
+        return request.user.is_anonymous
+
+    def personal_version(self, request):
+        return 0
+
+    def personalize(self, request, data):
+        return data
+
+    def cached_response(self, request, build):
+        if not self.is_cacheable(request):
+            return build()
+        self.shared_response = True
+        version = cache_version(self.cache_namespace)
+        personal_version = self.personal_version(request)
+        key = request_cache_key(request, self.cache_namespace, version)
+        etag = quote_etag(hashlib.md5(
+            f'{key}:{personal_version}'.encode()).hexdigest())
+        last_modified = max(version, personal_version) // 10 ** 9
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            count(self.cache_namespace, 'hit')
+            return not_modified
+        data = cache.get(key)
+        if data is None:
+            count(self.cache_namespace, 'miss')
+            response = build()
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+            response.data = self.personalize(request, response.data)
+            response['X-Cache'] = 'MISS'
+        else:
+            count(self.cache_namespace, 'hit')
+            response = Response(self.personalize(request, data))
+            response['X-Cache'] = 'HIT'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs))
@@ -0,0 +1,129 @@
+import threading
+from functools import partial
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+from psycopg2 import pool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ThreadedConnectionPool(pool.ThreadedConnectionPool):
+    """Пул psycopg2, открывающий соединения функцией connect."""
+
+    def __init__(self, size, connect):
+        self.connect = connect
+        super().__init__(size, size)
+
+    def _connect(self, key=None):
+        connection = self.connect()
+        if key is not None:
+            self._used[key] = connection
+            self._rused[id(connection)] = key
+        else:
+            self._pool.append(connection)
+        return connection
+
+
+class ConnectionPool:
+    """
+    Пул на size открытых соединений; при занятых соединениях ждет до
+    timeout секунд, а не сразу падает с PoolError. Соединения открывает
+    connect - get_new_connection бэкенда PostgreSQL Django со всей его
+    настройкой соединения.
+    """
+
+    def __init__(self, size, timeout, connect):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.connections = ThreadedConnectionPool(size, connect)
+
+    def get(self, health_check=False):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise base.Database.OperationalError(
+                f'Нет свободных соединений в пуле за {self.timeout} с')
+        try:
+            connection = self.connections.getconn()
+            if connection.closed or health_check and not alive(connection):
+                self.connections.putconn(connection, close=True)
+                connection = self.connections.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        return connection
+
+    def put(self, connection):
+        try:
+            self.connections.putconn(connection, close=bool(connection.closed))
+        finally:
+            self.slots.release()
+
+
+def close_pools():
+    with _pools_lock:
+        for connection_pool in _pools.values():
+            connection_pool.connections.closeall()
+        _pools.clear()
+
+
+def alive(connection):
+    """SELECT 1 в autocommit: проверка не должна оставлять открытую
+    транзакцию, иначе set_autocommit() и set_session() Django падают."""
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except base.Database.Error:
+        return False
+    return True
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        """Соединения пула держат тестовую базу, DROP DATABASE ждал бы
+        их."""
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с пулом соединений в процессе на POOL_SIZE соединений:
+    для воркеров gunicorn с потоками (gthread) соединение, закрытое в
+    конце запроса, возвращается в пул, а не разрывается. Незакрытая
+    транзакция при возврате откатывается, при выдаче из пула соединение
+    проверяется, если включен CONN_HEALTH_CHECKS.
+    """
+
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        """Пул процесса для этих параметров подключения (тестовая база
+        получает свой пул)."""
+        key = (self.alias, repr(sorted(conn_params.items())))
+        with _pools_lock:
+            if key not in _pools:
+                size = self.settings_dict.get('POOL_SIZE')
+                if not size:
+                    raise ImproperlyConfigured(
+                        'Для api_foodgram.db нужен POOL_SIZE > 0')
+                _pools[key] = ConnectionPool(
+                    size, self.settings_dict.get('POOL_TIMEOUT', 10),
+                    partial(super().get_new_connection, conn_params))
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        self.connection_pool = self.get_pool(conn_params)
+        connection = self.connection_pool.get(
+            self.settings_dict.get('CONN_HEALTH_CHECKS', False))
+        # уровень изоляции выставлен при открытии соединения
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.connection_pool.put(self.connection)
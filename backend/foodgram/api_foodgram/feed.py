@@ -0,0 +1,137 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q
+from users.models import Subscribe
+
+from .models import FeedItem, Recipe
+from .utils import author_recipe_previews
+
+
+def fans_out(author):
+    """Рецепты автора раскладываются по лентам подписчиков при записи;
+    у авторов с очень большим числом подписчиков - добавляются при
+    чтении ленты."""
+    return author.followers_count <= settings.FEED_FANOUT_LIMIT
+
+
+def insert_items(items):
+    items = list(items)
+    FeedItem.objects.bulk_create(
+        items,
+        batch_size=connection.ops.bulk_batch_size(
+            ['user_id', 'recipe_id', 'author_id', 'pub_date'], items),
+        ignore_conflicts=True
+    )
+
+
+def fan_out_recipe(recipe):
+    """Добавляет новый рецепт во входящие ленты подписчиков автора."""
+    if not fans_out(recipe.author):
+        return
+    insert_items(
+        FeedItem(user_id=user_id, recipe_id=recipe.id,
+                 author_id=recipe.author_id, pub_date=recipe.pub_date)
+        for user_id in Subscribe.objects.filter(
+            author_id=recipe.author_id).values_list('user_id', flat=True)
+    )
+
+
+def backfill_feed(user, author):
+    """При подписке добавляет во входящую ленту последние рецепты
+    автора."""
+    backfill_feeds(user, [author])
+
+
+def backfill_feeds(user, authors):
+    """
+    То же для нескольких авторов: превью всех авторов одним запросом,
+    одна вставка и одна обрезка ленты.
+    """
+    author_ids = [author.id for author in authors if fans_out(author)]
+    if not author_ids:
+        return
+    previews = author_recipe_previews(author_ids, settings.FEED_INBOX_LENGTH)
+    insert_items(
+        FeedItem(user_id=user.id, recipe_id=recipe.id, author_id=author_id,
+                 pub_date=recipe.pub_date)
+        for author_id in author_ids
+        for recipe in previews[author_id]
+    )
+    trim_feeds([user.id])
+
+
+def drop_author(user, author):
+    """При отписке убирает рецепты автора из входящей ленты."""
+    FeedItem.objects.filter(user=user, author=author).delete()
+
+
+def drop_authors(user, author_ids):
+    """То же для нескольких авторов одним запросом."""
+    FeedItem.objects.filter(user=user, author_id__in=author_ids).delete()
+
+
+def trim_feeds(user_ids=None):
+    """
+    Оставляет во входящих лентах FEED_INBOX_LENGTH последних записей.
+    Возвращает число удаленных записей.
+    """
+    limit = settings.FEED_INBOX_LENGTH
+    items = FeedItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    overfull = items.values('user_id').annotate(
+        total=Count('pk')).filter(total__gt=limit).order_by()
+    deleted = 0
+    for row in overfull:
+        user_items = FeedItem.objects.filter(user_id=row['user_id'])
+        pub_date, recipe_id = user_items.order_by(
+            '-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id')[limit]
+        deleted += user_items.filter(
+            Q(pub_date__lt=pub_date)
+            | Q(pub_date=pub_date, recipe_id__lte=recipe_id)
+        ).delete()[0]
+    return deleted
+
+
+def rebuild_feeds(user_ids=None):
+    """Заново заполняет входящие ленты по подпискам."""
+    items = FeedItem.objects.all()
+    subscriptions = Subscribe.objects.filter(
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT)
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+    items.delete()
+    pairs = list(subscriptions.values_list('user_id', 'author_id'))
+    previews = author_recipe_previews(
+        {author_id for _, author_id in pairs}, settings.FEED_INBOX_LENGTH)
+    insert_items(
+        FeedItem(user_id=user_id, recipe_id=recipe.id, author_id=author_id,
+                 pub_date=recipe.pub_date)
+        for user_id, author_id in pairs
+        for recipe in previews[author_id]
+    )
+    trim_feeds(user_ids)
+    return len(pairs)
+
+
+def feed_recipe_ids(user):
+    """
+    id рецептов ленты пользователя, не больше FEED_INBOX_LENGTH: из
+    входящей ленты и последние рецепты авторов без fan-out, на которых
+    он подписан. Два запроса по индексам, без соединения подписок с
+    рецептами.
+    """
+    limit = settings.FEED_INBOX_LENGTH
+    entries = list(FeedItem.objects.filter(user=user).order_by(
+        '-pub_date', '-recipe_id'
+    ).values_list('pub_date', 'recipe_id')[:limit])
+    read_authors = Subscribe.objects.filter(
+        user=user, author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).values('author_id')
+    entries.extend(Recipe.objects.filter(
+        author_id__in=read_authors
+    ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit])
+    entries.sort(reverse=True)
+    return list(dict.fromkeys(recipe_id for _, recipe_id in entries))[:limit]
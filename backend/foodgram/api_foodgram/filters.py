@@ -3,6 +3,7 @@ from rest_framework.filters import SearchFilter
 from users.models import User
 
 from .models import Recipe, Tag
+from .search import search_recipes
 
 
 class RecipeFilter(FilterSet):
@@ -18,21 +19,26 @@ class RecipeFilter(FilterSet):
         method='is_in_shopping_cart_method')
     is_favorited = filters.NumberFilter(
         method='is_favorited_method')
+    search = filters.CharFilter(method='search_method')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
 
     def is_favorited_method(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(Favorite_recipe__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def is_in_shopping_cart_method(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(basket__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
+    def search_method(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
 
 class IngredientSearchFilter(SearchFilter):
     # name = filters.CharFilter(
@@ -0,0 +1,125 @@
+import base64
+import binascii
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connection
+from PIL import Image, features
+
+from .cache import bump_cache_version
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+BASE64_CHUNK = 64 * 1024
+VARIANT_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+
+executor = (
+    ThreadPoolExecutor(max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                       thread_name_prefix='recipe-images')
+    if settings.IMAGE_PROCESSING_WORKERS else None
+)
+
+
+def decoded_size(data):
+    """Размер файла из строки base64 без декодирования."""
+    return len(data) * 3 // 4 - data[-2:].count('=')
+
+
+def decode_base64(data, name, content_type):
+    """
+    Декодирует base64 частями во временный файл на диске, не собирая
+    всю картинку в памяти одним bytes-объектом.
+    """
+    file = TemporaryUploadedFile(name, content_type, decoded_size(data),
+                                 None)
+    try:
+        for start in range(0, len(data), BASE64_CHUNK):
+            file.write(base64.b64decode(data[start:start + BASE64_CHUNK]))
+    except binascii.Error:
+        file.close()
+        raise
+    file.seek(0)
+    return file
+
+
+def variant_formats():
+    return [(extension, image_format)
+            for extension, image_format in VARIANT_FORMATS
+            if extension != 'webp' or features.check('webp')]
+
+
+def variant_name(name, width, extension):
+    base = os.path.splitext(name)[0]
+    return f'{base}_{width}.{extension}'
+
+
+def make_variants(recipe_id, name):
+    """
+    Уменьшенные копии картинки рецепта на ширины RECIPE_IMAGE_WIDTHS
+    во всех форматах; после записи рецепт помечается готовым, если
+    картинку за это время не заменили. Возвращает успех обработки.
+    """
+    try:
+        with default_storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+        image = image.convert('RGB')
+        for width in settings.RECIPE_IMAGE_WIDTHS:
+            variant = image.copy()
+            variant.thumbnail((width, width * 10), Image.LANCZOS)
+            for extension, image_format in variant_formats():
+                buffer = io.BytesIO()
+                variant.save(buffer, image_format, quality=80)
+                target = variant_name(name, width, extension)
+                default_storage.delete(target)
+                default_storage.save(target, ContentFile(buffer.getvalue()))
+        Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants_ready=True)
+        bump_cache_version('recipes')
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+        return False
+    return True
+
+
+def make_variants_in_worker(recipe_id, name):
+    try:
+        make_variants(recipe_id, name)
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """
+    Ставит обработку картинки в пул потоков; при
+    IMAGE_PROCESSING_WORKERS = 0 обрабатывает сразу в текущем потоке.
+    """
+    if executor is None:
+        make_variants(recipe.pk, recipe.image.name)
+        return
+    executor.submit(make_variants_in_worker, recipe.pk, recipe.image.name)
+
+
+def image_variants(recipe, request=None):
+    """{формат: {ширина: url}} готовых копий картинки рецепта."""
+    if not recipe.image_variants_ready:
+        return {}
+    variants = {}
+    for extension, _ in variant_formats():
+        variants[extension] = {}
+        for width in settings.RECIPE_IMAGE_WIDTHS:
+            url = default_storage.url(
+                variant_name(recipe.image.name, width, extension))
+            variants[extension][str(width)] = (
+                request.build_absolute_uri(url) if request else url)
+    return variants
@@ -0,0 +1,114 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .models import Ingredient
+
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+
+
+class IngredientIndex:
+    """
+    Индекс справочника ингредиентов в памяти процесса для автодополнения.
+
+    Названия в нижнем регистре хранятся отсортированными: ингредиенты,
+    начинающиеся с запроса, находятся бинарным поиском, совпадения
+    внутри названия - поиском подстроки по склеенной строке всех
+    названий и идут после них.
+    Индекс сбрасывается сигналами при изменении Ingredient в текущем
+    процессе и перечитывается по истечении INGREDIENT_INDEX_TTL, чтобы
+    подхватить изменения, сделанные в других воркерах gunicorn.
+    Пока индекс не загружен, поиск идет в базу, а загрузка выполняется
+    в фоновом потоке.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._generation = 0
+        self._loading = threading.Lock()
+
+    def build(self):
+        generation = self._generation
+        entries = sorted(
+            Ingredient.objects.values(*INGREDIENT_FIELDS),
+            key=lambda entry: (entry['name'].lower(), entry['id'])
+        )
+        keys = [entry['name'].lower() for entry in entries]
+        offsets = []
+        position = 0
+        for key in keys:
+            offsets.append(position)
+            position += len(key) + 1
+        if generation == self._generation:
+            self._state = (keys, entries, '\n'.join(keys), offsets,
+                           time.monotonic())
+
+    def invalidate(self):
+        self._generation += 1
+        self._state = None
+
+    def is_warm(self):
+        state = self._state
+        if state is None:
+            return False
+        return time.monotonic() - state[-1] < settings.INGREDIENT_INDEX_TTL
+
+    def warm_up(self):
+        """Загружает индекс в фоновом потоке, если он еще не грузится."""
+        if not self._loading.acquire(blocking=False):
+            return
+        thread = threading.Thread(target=self._load, daemon=True)
+        thread.start()
+
+    def _load(self):
+        try:
+            self.build()
+        except DatabaseError:
+            pass
+        finally:
+            connection.close()
+            self._loading.release()
+
+    def search(self, query, limit=None):
+        """
+        Ингредиенты, в названии которых есть query: сначала начинающиеся
+        с query, затем остальные, внутри групп - по алфавиту.
+        """
+        query = query.lower().replace('\n', '')
+        if not self.is_warm():
+            self.warm_up()
+            return search_db(query, limit)
+        keys, entries, haystack, offsets, _ = self._state
+        results = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and keys[position].startswith(query)
+               and (limit is None or len(results) < limit)):
+            results.append(entries[position])
+            position += 1
+        found = haystack.find(query)
+        while found != -1 and (limit is None or len(results) < limit):
+            position = bisect_right(offsets, found) - 1
+            if offsets[position] != found:
+                results.append(entries[position])
+            if position + 1 == len(offsets):
+                break
+            found = haystack.find(query, offsets[position + 1])
+        return results
+
+
+def search_db(query, limit=None):
+    """Тот же поиск запросами к базе, пока индекс не загружен."""
+    ingredients = Ingredient.objects.order_by('name', 'id').values(
+        *INGREDIENT_FIELDS)
+    results = list(ingredients.filter(name__istartswith=query)[:limit])
+    if limit is None or len(results) < limit:
+        rest = None if limit is None else limit - len(results)
+        results.extend(ingredients.filter(name__icontains=query).exclude(
+            name__istartswith=query)[:rest])
+    return results
+
+
+ingredient_index = IngredientIndex()
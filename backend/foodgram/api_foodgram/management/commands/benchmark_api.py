@@ -0,0 +1,169 @@
+import json
+import os
+from functools import partial
+
+from api_foodgram.benchmarks import (compare_connections, compare_renderers,
+                                     compare_serializers,
+                                     compare_with_baseline, race_toggles,
+                                     run_benchmarks, seed_dataset)
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from users.models import User
+
+DEFAULT_BASELINE = os.path.join(
+    settings.BASE_DIR, 'data', 'benchmark_baseline.json')
+DATASET_OPTIONS = ('users', 'recipes', 'ingredients_per_recipe')
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеры числа SQL-запросов и времени ответа (p50/p95) основных '
+        'адресов API на синтетических данных. Работает в отдельной '
+        'тестовой базе текущего DB_ENGINE и падает, если число запросов '
+        'выросло относительно сохраненной базовой линии; рост p95 - '
+        'только предупреждение.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--only', nargs='*',
+                            help='замерять только указанные сценарии')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='записать результаты как базовую линию')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='рост p95 без предупреждения, доля от '
+                                 'базового')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='не удалять тестовую базу и данные')
+        parser.add_argument('--serializers', action='store_true',
+                            help='сравнить RecipeSerializer и '
+                                 'RecipeReadSerializer на странице из '
+                                 '100 рецептов')
+        parser.add_argument('--renderers', action='store_true',
+                            help='сравнить размер (с gzip и без) и время '
+                                 'рендеринга JSON страницы из 100 '
+                                 'рецептов')
+        parser.add_argument('--race', type=int, metavar='WORKERS',
+                            help='проверить параллельные добавления и '
+                                 'удаления избранного, корзины и подписки '
+                                 'из WORKERS потоков')
+        parser.add_argument('--connections', action='store_true',
+                            help='сравнить время запроса с новым и с '
+                                 'постоянным соединением с базой')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+            keepdb=options['keepdb'])
+        try:
+            if not User.objects.filter(username__startswith='bench').exists():
+                self.stdout.write('Заполнение тестовой базы...')
+                seed_dataset(
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    ingredients_per_recipe=options['ingredients_per_recipe'])
+            report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+        report()
+
+    def run(self, options):
+        """Замеры в тестовой базе; возвращает вывод их результатов."""
+        repeat = options['repeat']
+        if options['serializers']:
+            return partial(self.report_serializers,
+                           compare_serializers(repeat=repeat))
+        if options['renderers']:
+            return partial(self.report_renderers,
+                           compare_renderers(repeat=repeat))
+        in_memory = (connection.vendor == 'sqlite'
+                     and connection.is_in_memory_db())
+        if options['race']:
+            if in_memory:
+                raise CommandError(
+                    '--race нужна база с параллельной записью: PostgreSQL '
+                    'или SQLite с файлом тестовой базы (TEST NAME)')
+            return partial(self.report_race, race_toggles(options['race']))
+        if options['connections']:
+            if in_memory:
+                raise CommandError(
+                    '--connections нужна база, соединение с которой '
+                    'можно закрыть: PostgreSQL или SQLite с файлом '
+                    'тестовой базы (TEST NAME)')
+            return partial(self.report_connections,
+                           compare_connections(repeat=repeat))
+        return partial(self.report, run_benchmarks(repeat, options['only']),
+                       options)
+
+    def report_race(self, results):
+        for name, statuses in results.items():
+            self.stdout.write(f'{name:<24}{statuses}')
+        self.stdout.write(self.style.SUCCESS(
+            'Гонок нет, счетчики согласованы'))
+
+    def report_connections(self, timings):
+        for name, timing in timings.items():
+            self.stdout.write(f'{name:<24}{timing:>12} мс')
+        self.stdout.write(
+            f'CONN_MAX_AGE={connection.settings_dict["CONN_MAX_AGE"]}, '
+            f'пул: {connection.settings_dict.get("POOL_SIZE") or "нет"}')
+
+    def report_serializers(self, timings):
+        for name, timing in timings.items():
+            self.stdout.write(f'{name:<24}{timing:>12} мс CPU')
+        self.stdout.write(self.style.SUCCESS('JSON совпадает'))
+
+    def report_renderers(self, rendering):
+        self.stdout.write(f'{"рендерер":<24}{"байт":>10}{"gzip":>10}'
+                          f'{"p50, мс":>12}')
+        for name, result in rendering.items():
+            self.stdout.write(f'{name:<24}{result["bytes"]:>10}'
+                              f'{result["gzip_bytes"]:>10}'
+                              f'{result["p50_ms"]:>12}')
+
+    def report(self, results, options):
+        self.stdout.write(f'{"сценарий":<24}{"запросов":>10}'
+                          f'{"p50, мс":>12}{"p95, мс":>12}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<24}{result["queries"]:>10}'
+                              f'{result["p50_ms"]:>12}{result["p95_ms"]:>12}')
+
+        dataset = {name: options[name] for name in DATASET_OPTIONS}
+        baseline = {'dataset': dataset, 'scenarios': {}}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        if options['save_baseline']:
+            if baseline['dataset'] != dataset:
+                baseline = {'dataset': dataset, 'scenarios': {}}
+            baseline['scenarios'].update(results)
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(baseline, file, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовая линия сохранена в {options["baseline"]}'))
+            return
+        if not baseline['scenarios']:
+            self.stdout.write(self.style.WARNING(
+                'Базовая линия не найдена, сравнение пропущено'))
+            return
+        regressions, slowdowns = compare_with_baseline(
+            results, baseline['scenarios'], options['tolerance'])
+        if baseline['dataset'] != dataset:
+            self.stdout.write(self.style.WARNING(
+                f'Базовая линия снята на данных {baseline["dataset"]}, '
+                f'время не сравнивается'))
+        elif slowdowns:
+            self.stdout.write(self.style.WARNING(
+                'p95 выросло больше допуска (--tolerance), проверьте '
+                'повторным запуском:\n' + '\n'.join(slowdowns)))
+        if regressions:
+            raise CommandError('Выросло число SQL-запросов:\n'
+                               + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
@@ -0,0 +1,39 @@
+import time
+
+from api_foodgram.cache import bump_cache_version
+from api_foodgram.models import RecipeScore
+from api_foodgram.utils import calculate_recipe_scores
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинги рецептов для лент ?ordering=popular и '
+        '?ordering=trending. Запускается периодически (например, cron '
+        'раз в 10-15 минут); рецепты, созданные после последнего '
+        'запуска, появляются в этих лентах после следующего.'
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        now = timezone.now()
+        scores = [
+            RecipeScore(recipe_id=pk, popular=popular, trending=trending,
+                        computed_at=now)
+            for pk, (popular, trending) in calculate_recipe_scores(
+                now).items()
+        ]
+        with transaction.atomic():
+            RecipeScore.objects.all().delete()
+            RecipeScore.objects.bulk_create(
+                scores,
+                batch_size=connection.ops.bulk_batch_size(
+                    ['recipe_id', 'popular', 'trending', 'computed_at'],
+                    scores)
+            )
+        bump_cache_version('recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинги пересчитаны: {len(scores)} рецептов, '
+            f'{time.perf_counter() - start:.2f} с'))
@@ -0,0 +1,90 @@
+from api_foodgram.benchmarks import (ENDPOINT_SETTINGS, NO_CACHE, endpoints,
+                                     payloads, request)
+from api_foodgram.models import Recipe
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет запросы основных адресов API (как benchmark_api) '
+        'на текущей базе с отключенным кэшем ответов и печатает план '
+        'EXPLAIN каждого SQL-запроса, чтобы проверить использование '
+        'индексов после деплоя. Данные не изменяются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='*',
+                            help='только указанные сценарии')
+        parser.add_argument('--user',
+                            help='email пользователя, от имени которого '
+                                 'выполняются запросы (по умолчанию - '
+                                 'с наибольшей корзиной)')
+        parser.add_argument('--analyze', action='store_true',
+                            help='EXPLAIN ANALYZE (только PostgreSQL)')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        client = APIClient()
+        client.force_authenticate(user)
+        anonymous = APIClient()
+        if not connection.features.supports_explaining_query_execution:
+            raise CommandError('СУБД не поддерживает EXPLAIN')
+        explain_options = {}
+        if options['analyze'] and connection.vendor == 'postgresql':
+            explain_options = {'analyze': True, 'buffers': True}
+        prefix = connection.ops.explain_query_prefix(**explain_options)
+
+        if not Recipe.objects.exists():
+            self.stdout.write(self.style.WARNING(
+                'В базе нет рецептов: страница рецепта не проверяется, '
+                'списки пусты'))
+        data = payloads()
+        with override_settings(CACHES=NO_CACHE):
+            for name, (url, authenticated) in endpoints().items():
+                # *_cached без кэша повторяют те же запросы
+                if name.endswith('_cached') or (
+                        options['only'] and name not in options['only']):
+                    continue
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f'{name}: {"POST" if name in data else "GET"} {url}'))
+                with override_settings(**ENDPOINT_SETTINGS.get(name, {})):
+                    queries = self.capture(
+                        client if authenticated else anonymous, url,
+                        data.get(name))
+                for number, sql in enumerate(queries, 1):
+                    self.stdout.write(self.style.SQL_KEYWORD(
+                        f'[{number}] {sql}'))
+                    for line in self.explain(prefix, sql):
+                        self.stdout.write(f'    {line}')
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден')
+            return user
+        user = User.objects.annotate(
+            recipes_in_basket=Count('basket')
+        ).order_by('-recipes_in_basket', 'id').first()
+        if user is None:
+            raise CommandError('В базе нет пользователей')
+        return user
+
+    def capture(self, client, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = request(client, url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return [query['sql'] for query in context.captured_queries
+                if query['sql'].lstrip().upper().startswith('SELECT')]
+
+    def explain(self, prefix, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}')
+            for row in cursor.fetchall():
+                yield ' '.join(str(column) for column in row)
@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+import os
+import time
+
+from api_foodgram.cache import bump_cache_version
+from api_foodgram.models import Ingredient, Tag
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+DEFAULT_PATH = os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv')
+READ_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield 'ingredient', {'name': row[0].strip(),
+                                 'measurement_unit': row[1].strip()}
+
+
+def iter_json(file):
+    """
+    Разбирает JSON-массив фикстуры (или JSON Lines) по одному объекту,
+    читая файл кусками, так что весь файл в памяти не держится.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer) and eof:
+            return
+        try:
+            if position == len(buffer):
+                raise ValueError
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise CommandError('Некорректный JSON в файле')
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        model = item.get('model', 'api_foodgram.ingredient').split('.')[-1]
+        yield model.lower(), item.get('fields', item)
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты (и теги из JSON-фикстуры) из '
+        'data/ingredients.csv или .json. Файл читается частями, дубли '
+        'отбрасываются, уже существующие записи пропускаются, так что '
+        'команду можно запускать повторно. На PostgreSQL ингредиенты '
+        'загружаются через COPY.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--upsert', action='store_true',
+                            help='обновлять название и цвет существующих '
+                                 'тегов по slug')
+        parser.add_argument('--no-copy', action='store_true',
+                            help='не использовать COPY на PostgreSQL')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        start = time.perf_counter()
+        before = Ingredient.objects.count()
+        read = 0
+        seen = set()
+        tags = []
+
+        def ingredients(items):
+            nonlocal read
+            for model, fields in items:
+                read += 1
+                if model == 'tag':
+                    tags.append(fields)
+                    continue
+                key = (fields['name'], fields['measurement_unit'])
+                if model == 'ingredient' and key not in seen:
+                    seen.add(key)
+                    yield key
+
+        with open(path, encoding='utf-8') as file, transaction.atomic():
+            items = iter_json(file) if path.endswith('.json') else iter_csv(
+                file)
+            for chunk in chunked(ingredients(items), options['batch_size']):
+                if use_copy:
+                    self.copy_chunk(chunk)
+                else:
+                    self.insert_chunk(chunk)
+            self.load_tags(tags, options['upsert'])
+        bump_cache_version('ingredients')
+
+        created = Ingredient.objects.count() - before
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано записей: {read}, уникальных ингредиентов: '
+            f'{len(seen)}, добавлено: {created}, тегов: {len(tags)}. '
+            f'{elapsed:.2f} с, {read / elapsed if elapsed else read:.0f} '
+            f'записей/с'))
+
+    def insert_chunk(self, chunk):
+        objs = [Ingredient(name=name, measurement_unit=unit)
+                for name, unit in chunk]
+        Ingredient.objects.bulk_create(
+            objs,
+            batch_size=connection.ops.bulk_batch_size(
+                ['name', 'measurement_unit'], objs),
+            ignore_conflicts=True
+        )
+
+    def copy_chunk(self, chunk):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS ingredient_load '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP')
+            cursor.copy_expert(
+                'COPY ingredient_load (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ingredient_load '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+            cursor.execute('TRUNCATE ingredient_load')
+
+    def load_tags(self, tags, upsert):
+        for fields in tags:
+            defaults = {'name': fields['name'], 'color': fields['color']}
+            if upsert:
+                Tag.objects.update_or_create(slug=fields['slug'],
+                                             defaults=defaults)
+            else:
+                Tag.objects.get_or_create(slug=fields['slug'],
+                                          defaults=defaults)
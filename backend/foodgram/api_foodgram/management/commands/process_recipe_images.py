@@ -0,0 +1,26 @@
+from api_foodgram.images import make_variants
+from api_foodgram.models import Recipe
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает уменьшенные копии картинок рецептов, для которых их еще '
+        'нет: загруженных до появления обработки или не обработанных '
+        'из-за перезапуска воркера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='пересоздать копии для всех рецептов')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants_ready=False)
+        total = processed = 0
+        for recipe_id, name in recipes.values_list('id', 'image').iterator():
+            total += 1
+            processed += make_variants(recipe_id, name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {processed} из {total}'))
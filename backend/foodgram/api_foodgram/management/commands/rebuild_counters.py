@@ -0,0 +1,37 @@
+from api_foodgram.utils import COUNTERS, counted
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает поля-счетчики (избранное и корзины рецептов, '
+        'рецепты и подписчики пользователей) по связанным записям или, '
+        'с --verify, только сообщает о расхождениях.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        mismatches = []
+        with transaction.atomic():
+            for model, field in COUNTERS:
+                wrong = counted(model, field).exclude(
+                    **{field: F('actual')}
+                ).values_list('pk', field, 'actual')
+                for pk, stored, actual in wrong:
+                    mismatches.append(
+                        f'{model._meta.model_name} {pk}, {field}: '
+                        f'сохранено {stored}, ожидалось {actual}')
+                    if not options['verify']:
+                        model.objects.filter(pk=pk).update(**{field: actual})
+        if options['verify'] and mismatches:
+            raise CommandError('Расхождения в счетчиках:\n'
+                               + '\n'.join(mismatches))
+        for line in mismatches:
+            self.stdout.write(f'исправлено: {line}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики согласованы, исправлено: {len(mismatches)}'))
@@ -0,0 +1,30 @@
+from api_foodgram.feed import rebuild_feeds, trim_feeds
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново заполняет входящие ленты подписок (/api/recipes/feed/) '
+        'или, с --trim, только обрезает их до FEED_INBOX_LENGTH записей. '
+        'Полную пересборку нужно выполнить один раз после миграции, '
+        '--trim - запускать периодически.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='*', dest='users',
+                            help='id пользователей, по умолчанию все')
+        parser.add_argument('--trim', action='store_true',
+                            help='только обрезать ленты')
+
+    def handle(self, *args, **options):
+        users = options['users'] or None
+        with transaction.atomic():
+            if options['trim']:
+                deleted = trim_feeds(users)
+                self.stdout.write(self.style.SUCCESS(
+                    f'Ленты обрезаны, удалено записей: {deleted}'))
+                return
+            subscriptions = rebuild_feeds(users)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересобраны, подписок: {subscriptions}'))
@@ -0,0 +1,68 @@
+from api_foodgram.models import ShoppingListItem
+from api_foodgram.utils import calculate_shopping_lists
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+AMOUNT_PRECISION = 1e-6
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает материализованные списки покупок по корзинам '
+        'пользователей или, с --verify, только сверяет их и сообщает '
+        'о расхождениях.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='*', dest='users',
+                            help='id пользователей, по умолчанию все')
+        parser.add_argument('--verify', action='store_true',
+                            help='только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        users = options['users'] or None
+        expected = {
+            (row['user'], row['ingredient_pk']): (row['total'],
+                                                  row['recipes'])
+            for row in calculate_shopping_lists(users)
+        }
+        if options['verify']:
+            self.verify(expected, users)
+            return
+        items = ShoppingListItem.objects.all()
+        if users is not None:
+            items = items.filter(user_id__in=users)
+        with transaction.atomic():
+            items.delete()
+            ShoppingListItem.objects.bulk_create(
+                ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                                 amount=amount, recipes_count=count)
+                for (user, ingredient), (amount, count) in expected.items()
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, строк: {len(expected)}'))
+
+    def verify(self, expected, users):
+        items = ShoppingListItem.objects.all()
+        if users is not None:
+            items = items.filter(user_id__in=users)
+        stored = {
+            (user, ingredient): (amount, count)
+            for user, ingredient, amount, count in items.values_list(
+                'user_id', 'ingredient_id', 'amount', 'recipes_count')
+        }
+        mismatches = []
+        for key in expected.keys() | stored.keys():
+            amount, count = expected.get(key, (0, 0))
+            stored_amount, stored_count = stored.get(key, (0, 0))
+            if (count != stored_count
+                    or abs(amount - stored_amount) > AMOUNT_PRECISION):
+                mismatches.append(
+                    f'пользователь {key[0]}, ингредиент {key[1]}: '
+                    f'ожидалось {amount} ({count} рец.), '
+                    f'сохранено {stored_amount} ({stored_count} рец.)')
+        if mismatches:
+            raise CommandError('Расхождения в списках покупок:\n'
+                               + '\n'.join(mismatches))
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок согласованы, строк: {len(stored)}'))
@@ -0,0 +1,13 @@
+from api_foodgram.cache import response_cache_stats
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Счетчики попаданий и промахов кэша ответов API.'
+
+    def handle(self, *args, **options):
+        for namespace, stats in response_cache_stats().items():
+            total = stats['hit'] + stats['miss']
+            ratio = stats['hit'] / total * 100 if total else 0
+            self.stdout.write(f'{namespace:<12} попаданий: {stats["hit"]:<8} '
+                              f'промахов: {stats["miss"]:<8} {ratio:.1f}%')
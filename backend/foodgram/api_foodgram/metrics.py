@@ -0,0 +1,123 @@
+import time
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = tuple(2 ** power for power in range(14, 25))
+
+
+class NullMetric:
+    """Заглушка метрики, когда prometheus_client не установлен."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def histogram(name, documentation, labels=(), **kwargs):
+    if prometheus_client is None:
+        return NullMetric()
+    return prometheus_client.Histogram(name, documentation, labels, **kwargs)
+
+
+def counter(name, documentation, labels=()):
+    if prometheus_client is None:
+        return NullMetric()
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+REQUEST_LATENCY = histogram(
+    'foodgram_request_duration_seconds',
+    'Время ответа API по view и действию',
+    ('view', 'method', 'status')
+)
+REQUEST_QUERIES = histogram(
+    'foodgram_request_db_queries',
+    'Число SQL-запросов на запрос к API',
+    ('view',), buckets=QUERY_BUCKETS
+)
+RESPONSE_CACHE = counter(
+    'foodgram_response_cache_requests',
+    'Обращения к кэшу ответов API',
+    ('namespace', 'result')
+)
+SHOPPING_LIST_DURATION = histogram(
+    'foodgram_shopping_list_seconds',
+    'Время выгрузки списка покупок',
+    ('format',)
+)
+IMAGE_UPLOAD_BYTES = histogram(
+    'foodgram_image_upload_bytes',
+    'Размер загружаемых картинок рецептов',
+    buckets=BYTES_BUCKETS
+)
+
+
+class QueryCounter:
+    """execute_wrapper, считающий SQL-запросы."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def observe_stream(chunks, metric):
+    """Отдает chunks и записывает в metric время до конца выгрузки."""
+    started = time.perf_counter()
+    try:
+        yield from chunks
+    finally:
+        metric.observe(time.perf_counter() - started)
+
+
+def registry():
+    """
+    Реестр для выдачи: значения всех воркеров gunicorn читаются из
+    файлов каталога METRICS_DIR, только если задана переменная окружения
+    PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py); иначе - реестр процесса,
+    без чужих файлов, оставшихся от других процессов.
+    """
+    if not settings.METRICS_DIR:
+        return prometheus_client.REGISTRY
+    collector_registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry,
+                                       path=settings.METRICS_DIR)
+    return collector_registry
+
+
+def metric_samples(name):
+    """(метки, значение) всех значений метрики name."""
+    if prometheus_client is None:
+        return []
+    return [(sample.labels, sample.value)
+            for metric in registry().collect()
+            for sample in metric.samples if sample.name == name]
+
+
+def metrics_view(request):
+    """/metrics в текстовом формате Prometheus, только с заголовком
+    Authorization: Bearer METRICS_TOKEN; без METRICS_TOKEN адреса нет."""
+    if prometheus_client is None or not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+    return HttpResponse(prometheus_client.generate_latest(registry()),
+                        content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -0,0 +1,96 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+
+from .metrics import REQUEST_LATENCY, REQUEST_QUERIES, QueryCounter
+from .profiling import (current_profile, install_serializer_timing,
+                        profile_request, profiling_enabled,
+                        profiling_requested, view_name)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZip для ответов от RESPONSE_GZIP_MIN_LENGTH байт (списки рецептов,
+    справочник ингредиентов): мелкие ответы почти не сжимаются, а время
+    воркера на сжатие тратится. Потоковые ответы сжимаются всегда.
+    """
+
+    def process_response(self, request, response):
+        if (not response.streaming
+                and len(response.content) < settings.RESPONSE_GZIP_MIN_LENGTH):
+            return response
+        return super().process_response(request, response)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запросов к API: число SQL-запросов, время базы,
+    повторяющиеся формы запросов, время сериализации и рендеринга - в
+    заголовке Server-Timing; медленные запросы и SQL - в лог
+    api_foodgram.profiling. Если профилирование не включить ни
+    настройкой, ни заголовком, middleware отключается целиком, а
+    BaseSerializer.data не подменяется.
+    """
+
+    def __init__(self, get_response):
+        if not profiling_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_serializer_timing()
+
+    def __call__(self, request):
+        if not profiling_requested(request):
+            return self.get_response(request)
+        with profile_request() as profile:
+            response = self.get_response(request)
+        response['Server-Timing'] = profile.server_timing()
+        profile.log(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile()
+        if profile is not None:
+            profile.view = view_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        profile = current_profile()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.render_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Время ответа и число SQL-запросов по view (RecipeViewSet.list и
+    т.п.) для /metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metrics_view = None
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        view = request.metrics_view or 'unresolved'
+        REQUEST_LATENCY.labels(
+            view, request.method, f'{response.status_code // 100}xx'
+        ).observe(time.perf_counter() - started)
+        REQUEST_QUERIES.labels(view).observe(queries.queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_name(request, view_func)
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    IngredientsRecipe = apps.get_model('api_foodgram', 'IngredientsRecipe')
+    ShoppingListItem = apps.get_model('api_foodgram', 'ShoppingListItem')
+    rows = IngredientsRecipe.objects.filter(
+        recipe__basket__isnull=False
+    ).values('recipe__basket__user', 'ingredient').annotate(
+        total=models.Sum('amount'),
+        recipes=models.Count('recipe')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=row['recipe__basket__user'],
+            ingredient_id=row['ingredient'],
+            amount=row['total'],
+            recipes_count=row['recipes']
+        )
+        for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api_foodgram', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.FloatField(verbose_name='Количество')),
+                ('recipes_count', models.IntegerField(verbose_name='Число рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='api_foodgram.Ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Строка списка покупок',
+                'verbose_name_plural': 'Строки списка покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
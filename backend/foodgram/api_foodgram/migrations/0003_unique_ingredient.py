@@ -0,0 +1,54 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+def merge_rows(model, owner, keep, duplicates, summed):
+    """Переносит строки model с ингредиентов-дублей на keep, складывая
+    поля summed, если у владельца (owner) строка с keep уже есть."""
+    for row in model.objects.filter(ingredient_id__in=duplicates):
+        kept = model.objects.filter(
+            **{owner: getattr(row, owner)}, ingredient_id=keep).first()
+        if kept is None:
+            row.ingredient_id = keep
+            row.save()
+            continue
+        for field in summed:
+            setattr(kept, field, getattr(kept, field) + getattr(row, field))
+        kept.save()
+        row.delete()
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('api_foodgram', 'Ingredient')
+    IngredientsRecipe = apps.get_model('api_foodgram', 'IngredientsRecipe')
+    ShoppingListItem = apps.get_model('api_foodgram', 'ShoppingListItem')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in groups:
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep']).values_list('id', flat=True))
+        merge_rows(IngredientsRecipe, 'recipe_id', group['keep'],
+                   duplicates, ('amount',))
+        merge_rows(ShoppingListItem, 'user_id', group['keep'],
+                   duplicates, ('amount', 'recipes_count'))
+        Ingredient.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_foodgram', '0002_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:33
+
+from django.db import migrations
+
+INDEX_NAME = 'ingredient_name_trgm_idx'
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Триграммный GIN-индекс для поиска ингредиентов по подстроке:
+    Django строит icontains/istartswith как UPPER(name) LIKE UPPER(...),
+    поэтому индексируется то же выражение. Только для PostgreSQL.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(
+        apps.get_model('api_foodgram', 'Ingredient')._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} '
+        'USING gin (UPPER("name"::text) gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_foodgram', '0006_recipe_author_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
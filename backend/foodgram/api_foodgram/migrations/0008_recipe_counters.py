@@ -0,0 +1,44 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:36
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('api_foodgram.Recipe', 'favorites_count',
+     'api_foodgram.FavoriteRecipe', 'recipe'),
+    ('api_foodgram.Recipe', 'in_carts_count', 'api_foodgram.Basket', 'recipe'),
+    ('users.User', 'recipes_count', 'api_foodgram.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Subscribe', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model_name, field, source_name, key in COUNTERS:
+        actual = apps.get_model(source_name).objects.filter(
+            **{key: models.OuterRef('pk')}
+        ).order_by().values(key).annotate(
+            total=models.Count('pk')).values('total')
+        apps.get_model(model_name).objects.update(**{field: Coalesce(
+            models.Subquery(actual, output_field=models.IntegerField()), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_foodgram', '0007_ingredient_trigram_index'),
+        ('users', '0004_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:46
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+INDEX_NAME = 'recipe_search_vector_idx'
+FTS_TABLE = 'api_foodgram_recipe_search'
+
+
+def create_search_index(apps, schema_editor):
+    """
+    PostgreSQL: заполняет search_vector (русский стемминг, название
+    весит больше описания) и строит по нему GIN-индекс.
+    SQLite: создает и заполняет таблицу FTS5 для локального запуска.
+    """
+    Recipe = apps.get_model('api_foodgram', 'Recipe')
+    table = schema_editor.quote_name(Recipe._meta.db_table)
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        Recipe.objects.update(search_vector=(
+            SearchVector('name', weight='A', config='russian')
+            + SearchVector('text', weight='B', config='russian')))
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} '
+            'USING gin ("search_vector")')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING '
+            "fts5(name, text, tokenize='unicode61 remove_diacritics 2')")
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            f'SELECT "id", "name", "text" FROM {table}')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_foodgram', '0010_feed_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый индекс'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
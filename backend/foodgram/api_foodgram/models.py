@@ -1,7 +1,10 @@
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, validate_slug
 from django.db import models
-from users.models import User
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from foodgram.mixins import DerivedFieldsMixin
+from users.models import Subscribe, User
 
 
 class Ingredient(models.Model):
@@ -28,6 +31,10 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('id',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient')]
 
     def __str__(self):
         return f'{self.name}'
@@ -68,7 +75,45 @@ class Tag(models.Model):
         return f'{self.name}, {self.slug}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """
+    Выборки рецептов для ленты и карточки рецепта.
+
+    with_related - автор, теги и ингредиенты одним набором запросов
+    на страницу вместо запросов на каждый рецепт;
+    with_user_flags - признаки is_favorited, is_in_shopping_cart
+    и is_author_subscribed через Exists(), их читают сериализаторы.
+    """
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=IngredientsRecipe.objects.select_related(
+                    'ingredient')
+            )
+        )
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            false = Value(False, output_field=BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                is_author_subscribed=false
+            )
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(Basket.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_author_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author')))
+        )
+
+
+class Recipe(DerivedFieldsMixin, models.Model):
     """
     Базовая модель Ингредиента,
     опиcывается полеями author, pub_date, name, text, image, ingredients,
@@ -106,6 +151,11 @@ class Recipe(models.Model):
         help_text='Выберите фото блюда',
         upload_to='api_foodgram/media/'
     )
+    image_variants_ready = models.BooleanField(
+        verbose_name='Уменьшенные копии картинки готовы',
+        default=False,
+        editable=False
+    )
     ingredients = models.ManyToManyField(
         Ingredient,
         verbose_name='Ингредиенты',
@@ -122,9 +172,28 @@ class Recipe(models.Model):
         Tag,
         verbose_name='Название тега',
         help_text='Выберите тег')
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+        db_index=True
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый индекс',
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    derived_fields = ('favorites_count', 'in_carts_count', 'search_vector')
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         default_related_name = 'recipe'
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -132,6 +201,11 @@ class Recipe(models.Model):
             models.UniqueConstraint(
                 fields=['name', 'author'],
                 name='unique_recipe')]
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx')]
 
     def __str__(self):
         return (f'{self.name} c временем приготовления '
@@ -182,6 +256,11 @@ class FavoriteRecipe(models.Model):
         related_name='Favorite_recipe',
         on_delete=models.CASCADE
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Избранные рецепты'
@@ -210,6 +289,11 @@ class Basket(models.Model):
         on_delete=models.CASCADE,
         related_name='basket'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -223,3 +307,134 @@ class Basket(models.Model):
 
     def __str__(self):
         return f'{self.recipe}'
+
+
+class ShoppingListItem(models.Model):
+    """
+    Материализованный список покупок пользователя.
+
+    Одна строка на ингредиент: суммарное количество по всем рецептам
+    корзины и число этих рецептов. Обновляется инкрементально при
+    изменении корзины и состава рецептов (api_foodgram.utils),
+    пересобирается командой rebuild_shopping_lists.
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    amount = models.FloatField(
+        verbose_name='Количество'
+    )
+    recipes_count = models.IntegerField(
+        verbose_name='Число рецептов'
+    )
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} {self.amount}'
+
+
+class RecipeScore(models.Model):
+    """
+    Рейтинг рецепта для лент ?ordering=popular и ?ordering=trending.
+
+    popular - взвешенная сумма добавлений в избранное и в корзины за все
+    время, trending - те же добавления за последние RECIPE_TRENDING_DAYS
+    дней с затуханием вдвое каждые RECIPE_TRENDING_HALF_LIFE дней.
+    Пересчитывается периодически командой compute_recipe_scores.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score'
+    )
+    popular = models.FloatField(
+        verbose_name='Популярность'
+    )
+    trending = models.FloatField(
+        verbose_name='Популярность за последние дни'
+    )
+    computed_at = models.DateTimeField(
+        verbose_name='Дата расчета'
+    )
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(fields=['-popular', '-recipe'],
+                         name='recipe_score_popular_idx'),
+            models.Index(fields=['-trending', '-recipe'],
+                         name='recipe_score_trending_idx')]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.popular} / {self.trending}'
+
+
+class FeedItem(models.Model):
+    """
+    Входящая лента пользователя: рецепты авторов из его подписок.
+
+    Заполняется при публикации рецепта (fan-out on write) и при подписке,
+    ограничивается FEED_INBOX_LENGTH последними рецептами. Рецепты
+    авторов, у которых подписчиков больше FEED_FANOUT_LIMIT, сюда не
+    пишутся и добавляются в ленту при чтении (api_foodgram.feed).
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_item',
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_item_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_item_user_author_idx')]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
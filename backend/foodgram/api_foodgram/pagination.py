@@ -1,7 +1,174 @@
+import base64
+import binascii
+import json
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def approximate_count(queryset):
+    """
+    Оценка числа строк планировщиком PostgreSQL (EXPLAIN) вместо
+    COUNT(*) по всей выборке; на других СУБД - точный подсчет.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximatePaginator(Paginator):
+    @cached_property
+    def count(self):
+        return approximate_count(self.object_list)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу сортировки вместо OFFSET.
+
+    Курсор - закодированные значения полей ordering последней (или
+    первой, для ссылки назад) записи страницы; следующая страница
+    выбирается условием "строго после ключа", которое использует индекс
+    по тем же полям, так что глубокие страницы не дороже первой.
+    Последнее поле ordering должно быть уникальным (обычно id).
+    Общее число записей не считается, если не передан ?count=exact
+    или ?count=approximate.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+    page_size = settings.PAGE_SIZE
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param, '')
+        return int(value) if value.isdigit() and int(value) else (
+            self.page_size)
+
+    def encode_cursor(self, instance, reverse):
+        values = []
+        for name in self.ordering:
+            value = getattr(instance, name.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat')
+                          else value)
+        raw = json.dumps({'v': values, 'r': reverse}).encode()
+        cursor = base64.urlsafe_b64encode(raw).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values = [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, cursor['v'])
+            ]
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return values, bool(cursor['r'])
+        except (binascii.Error, KeyError, TypeError, ValueError,
+                ValidationError):
+            raise NotFound('Неверный курсор.')
+
+    def after(self, values, reverse):
+        """Условие "строго после ключа values" в порядке ordering."""
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, queryset.model)
+        ordering = self.ordering
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}'
+                        for name in ordering]
+        self.count = self.get_count(queryset, request)
+        if values is not None:
+            queryset = queryset.filter(self.after(values, reverse))
+        results = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+        self.next_link = self.previous_link = None
+        if results and (has_more or reverse):
+            self.next_link = self.encode_cursor(results[-1], False)
+        if results and values is not None and (has_more or not reverse):
+            self.previous_link = self.encode_cursor(results[0], True)
+        if not results and values is not None:
+            self.previous_link = remove_query_param(
+                self.base_url, self.cursor_query_param)
+        return results
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'approximate':
+            return approximate_count(queryset)
+        return None
+
+    def get_paginated_response(self, data):
+        response = {'next': self.next_link,
+                    'previous': self.previous_link,
+                    'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
 
 
 class PagePagination(PageNumberPagination):
+    """
+    Постраничный вывод ?page=&limit= для фронтенда.
+
+    ?count=approximate заменяет COUNT(*) оценкой планировщика.
+    Если у представления задан keyset_ordering, параметр ?cursor=
+    (в том числе пустой - первая страница) включает KeysetPagination.
+    """
     page_size_query_param = 'limit'
     page_size = settings.PAGE_SIZE
+    count_query_param = 'count'
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', None)
+        if (ordering and KeysetPagination.cursor_query_param
+                in request.query_params):
+            self.keyset = KeysetPagination(ordering)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.django_paginator_class = ApproximatePaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,184 @@
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework.serializers import BaseSerializer
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUES = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+def fingerprint_sql(sql):
+    """Форма запроса без значений: одинаковые формы в одном запросе к
+    API - признак N+1."""
+    sql = NUMBER.sub('?', STRING.sub('?', sql))
+    return VALUES.sub('(...)', sql)
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestProfile:
+    """
+    SQL-запросы, время базы, сериализации и рендеринга одного запроса
+    к API. Запросы к базе перехватываются через execute_wrapper, так что
+    DEBUG не нужен.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.serializing = False
+        self.fingerprints = Counter()
+        self.slow_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            fingerprint = fingerprint_sql(sql)
+            self.fingerprints[fingerprint] += 1
+            if duration * 1000 >= settings.SLOW_QUERY_MS:
+                self.slow_queries.append((fingerprint, duration))
+
+    def duplicates(self):
+        return [(fingerprint, count)
+                for fingerprint, count in self.fingerprints.most_common()
+                if count > 1]
+
+    def server_timing(self):
+        duplicates = sum(count for _, count in self.duplicates())
+        return ', '.join((
+            f'db;dur={milliseconds(self.db_time)};'
+            f'desc="{self.queries} queries"',
+            f'sql-dup;desc="{duplicates} repeated"',
+            f'serialize;dur={milliseconds(self.serialize_time)}',
+            f'render;dur={milliseconds(self.render_time)}',
+            f'total;dur={milliseconds(self.duration)}',
+        ))
+
+    def log(self, request, response):
+        """Медленные запросы к API и SQL - в лог JSON-строками."""
+        common = {
+            'time': timezone.now().isoformat(),
+            'view': self.view,
+            'method': request.method,
+            'path': request.get_full_path(),
+        }
+        for fingerprint, duration in self.slow_queries:
+            logger.warning(json.dumps(dict(
+                common, event='slow_query',
+                duration_ms=milliseconds(duration), sql=fingerprint
+            ), ensure_ascii=False))
+        if self.duration * 1000 < settings.SLOW_REQUEST_MS:
+            return
+        logger.warning(json.dumps(dict(
+            common, event='slow_request',
+            status=response.status_code,
+            duration_ms=milliseconds(self.duration),
+            queries=self.queries,
+            db_ms=milliseconds(self.db_time),
+            serialize_ms=milliseconds(self.serialize_time),
+            render_ms=milliseconds(self.render_time),
+            duplicates=[{'sql': fingerprint, 'count': count}
+                        for fingerprint, count in self.duplicates()[:10]],
+        ), ensure_ascii=False))
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def profile_request():
+    profile = RequestProfile()
+    _local.profile = profile
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            yield profile
+    finally:
+        profile.duration = time.perf_counter() - profile.started
+        _local.profile = None
+
+
+def profiling_enabled():
+    """Можно ли включить профилирование хоть для какого-то запроса."""
+    return bool(settings.SQL_PROFILING or settings.SQL_PROFILING_TOKEN
+                or settings.DEBUG)
+
+
+def profiling_requested(request):
+    """Профилирование включено SQL_PROFILING или заголовком X-Profile:
+    со значением SQL_PROFILING_TOKEN (при DEBUG - с любым)."""
+    if settings.SQL_PROFILING:
+        return True
+    value = request.META.get(PROFILE_HEADER)
+    if value is None:
+        return False
+    if settings.DEBUG:
+        return True
+    return bool(settings.SQL_PROFILING_TOKEN) and constant_time_compare(
+        value, settings.SQL_PROFILING_TOKEN)
+
+
+def view_name(request, view_func):
+    """RecipeViewSet.list, RecipeViewSet.favorite и т.п."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+def timed_data(data):
+    """Время в BaseSerializer.data, без двойного учета вложенных
+    сериализаторов."""
+    @functools.wraps(data)
+    def wrapper(serializer):
+        profile = current_profile()
+        if profile is None or profile.serializing:
+            return data(serializer)
+        profile.serializing = True
+        started = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            profile.serialize_time += time.perf_counter() - started
+            profile.serializing = False
+    wrapper.timed = True
+    return wrapper
+
+
+def install_serializer_timing():
+    """Подменяет BaseSerializer.data; вызывается, только если
+    профилирование включено (ProfilingMiddleware)."""
+    data = BaseSerializer.data.fget
+    if not getattr(data, 'timed', False):
+        BaseSerializer.data = property(timed_data(data))
@@ -0,0 +1,116 @@
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, Q
+
+from .models import IngredientsRecipe
+
+
+class RecipeIngredientIndex:
+    """
+    Инвертированный индекс ингредиент -> рецепты в памяти процесса для
+    подбора рецептов по имеющимся продуктам.
+
+    Для каждого ингредиента хранится отсортированный массив id рецептов
+    (array('I')), для каждого рецепта - число его ингредиентов. Запрос
+    складывает массивы выбранных ингредиентов и считает долю покрытых
+    строк рецепта без GROUP BY по всей таблице IngredientsRecipe.
+    Как и ingredient_index, сбрасывается сигналами в текущем процессе,
+    перечитывается по истечении RECIPE_INDEX_TTL и грузится в фоновом
+    потоке, пока запросы обслуживает база.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._generation = 0
+        self._loading = threading.Lock()
+
+    def build(self):
+        generation = self._generation
+        postings = {}
+        sizes = Counter()
+        rows = IngredientsRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id').values_list(
+            'ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator():
+            recipes = postings.get(ingredient_id)
+            if recipes is None:
+                recipes = postings[ingredient_id] = array('I')
+            recipes.append(recipe_id)
+            sizes[recipe_id] += 1
+        if generation == self._generation:
+            self._state = (postings, dict(sizes), time.monotonic())
+
+    def invalidate(self):
+        self._generation += 1
+        self._state = None
+
+    def is_warm(self):
+        state = self._state
+        if state is None:
+            return False
+        return time.monotonic() - state[-1] < settings.RECIPE_INDEX_TTL
+
+    def warm_up(self):
+        """Загружает индекс в фоновом потоке, если он еще не грузится."""
+        if not self._loading.acquire(blocking=False):
+            return
+        thread = threading.Thread(target=self._load, daemon=True)
+        thread.start()
+
+    def _load(self):
+        try:
+            self.build()
+        except DatabaseError:
+            pass
+        finally:
+            connection.close()
+            self._loading.release()
+
+    def match(self, ingredient_ids, max_missing=None):
+        """
+        Рецепты, в которых есть хотя бы один из ingredient_ids, как
+        список (id рецепта, покрытие, не хватает ингредиентов): сначала
+        с большим покрытием, затем с меньшим числом недостающих, затем
+        новые. max_missing отбрасывает рецепты, где не хватает больше.
+        """
+        if not self.is_warm():
+            self.warm_up()
+            return match_db(ingredient_ids, max_missing)
+        postings, sizes, _ = self._state
+        covered = Counter()
+        for ingredient_id in set(ingredient_ids):
+            covered.update(postings.get(ingredient_id, ()))
+        return rank_matches(
+            ((recipe_id, count, sizes[recipe_id])
+             for recipe_id, count in covered.items()),
+            max_missing
+        )
+
+
+def rank_matches(rows, max_missing=None):
+    """(id, покрыто, всего) -> отсортированные (id, покрытие, нехватка)."""
+    matches = [
+        (recipe_id, covered / total, total - covered)
+        for recipe_id, covered, total in rows
+        if max_missing is None or total - covered <= max_missing
+    ]
+    matches.sort(key=lambda match: (-match[1], match[2], -match[0]))
+    return matches
+
+
+def match_db(ingredient_ids, max_missing=None):
+    """Тот же подбор запросом к базе, пока индекс не загружен."""
+    rows = IngredientsRecipe.objects.values('recipe_id').annotate(
+        covered=Count('pk', filter=Q(ingredient_id__in=ingredient_ids)),
+        total=Count('pk')
+    ).filter(covered__gt=0).order_by().values_list(
+        'recipe_id', 'covered', 'total')
+    return rank_matches(rows, max_missing)
+
+
+recipe_index = RecipeIngredientIndex()
@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+import os
+from abc import ABCMeta, abstractmethod
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson: тот же компактный JSON в UTF-8, но
+    сериализуется в несколько раз быстрее. orjson - необязательная
+    зависимость; без нее, при JSON_RENDERER='json' и при запросе
+    с отступами (?indent=, Browsable API) работает JSONRenderer DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or settings.JSON_RENDERER != 'orjson'
+                or data is None or not self.compact or self.ensure_ascii
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # как и JSONRenderer, экранируем \u2028 и \u2029 для JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace(
+            '\u2029'.encode(), b'\\u2029')
+
+
+class Echo:
+    """Псевдофайл для csv.writer: writerow() возвращает готовую строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer, metaclass=ABCMeta):
+    """
+    Базовый рендерер списка покупок.
+
+    Выбирается DRF по ?format= или заголовку Accept, но сам ответ
+    формирует не render(), а генератор stream() подкласса.
+    """
+    charset = 'utf-8'
+
+    @abstractmethod
+    def stream(self, recipes_count, ingredients):
+        """Получает число рецептов и итератор строк агрегата
+        (ingredient__name, ingredient__measurement_unit, amounts) и
+        отдает ответ кусками."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Обычный Response через этот рендерер - это ответ с ошибкой
+        (например, 401), он отдается как JSON с типом application/json,
+        а не с типом формата списка."""
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, recipes_count, ingredients):
+        yield f'Список покупок.\nВыбрано рецептов:{recipes_count}\n'
+        for ingredient in ingredients:
+            yield (
+                f'{ingredient["ingredient__name"]} - '
+                f'{ingredient["amounts"]} '
+                f'{ingredient["ingredient__measurement_unit"]}\n'
+            )
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, recipes_count, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('ингредиент', 'количество', 'единица измерения'))
+        for ingredient in ingredients:
+            yield writer.writerow((ingredient['ingredient__name'],
+                                   ingredient['amounts'],
+                                   ingredient['ingredient__measurement_unit']))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, recipes_count, ingredients):
+        yield f'{{"recipes_count": {recipes_count}, "ingredients": ['
+        separator = ''
+        for ingredient in ingredients:
+            yield separator + json.dumps({
+                'name': ingredient['ingredient__name'],
+                'amount': ingredient['amounts'],
+                'measurement_unit': ingredient['ingredient__measurement_unit'],
+            }, ensure_ascii=False)
+            separator = ', '
+        yield ']}'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """
+    PDF собирается целиком в памяти средствами reportlab: формат не
+    допускает потоковую запись. reportlab входит в requirements.txt, для
+    кириллицы нужен TTF-шрифт из settings.SHOPPING_LIST_PDF_FONT; без
+    любого из них (локальный запуск) формат pdf не предлагается, а не
+    падает посреди выгрузки.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    @staticmethod
+    def available():
+        try:
+            import reportlab  # noqa: F401
+        except ImportError:
+            return False
+        return os.path.isfile(settings.SHOPPING_LIST_PDF_FONT)
+
+    def stream(self, recipes_count, ingredients):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.pdfgen import canvas
+
+        pdfmetrics.registerFont(
+            TTFont('ShoppingList', settings.SHOPPING_LIST_PDF_FONT))
+        buffer = io.BytesIO()
+        page = canvas.Canvas(buffer, pagesize=A4)
+        height = A4[1]
+        line_height = 18
+        top = height - 50
+        y = top
+        for line in ShoppingListTextRenderer().stream(
+                recipes_count, ingredients):
+            for text in line.rstrip('\n').split('\n'):
+                if y < 50:
+                    page.showPage()
+                    y = top
+                page.setFont('ShoppingList', 12)
+                page.drawString(50, y, text)
+                y -= line_height
+        page.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+) + ((ShoppingListPDFRenderer,)
+     if ShoppingListPDFRenderer.available() else ())
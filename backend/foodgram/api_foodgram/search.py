@@ -0,0 +1,86 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'api_foodgram_recipe_search'
+WORD = re.compile(r'\w+')
+
+
+def search_vector():
+    """tsvector рецепта: совпадения в названии весят больше, чем в
+    описании."""
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG))
+
+
+def index_recipes(recipe_ids=None):
+    """
+    Обновляет поисковый индекс рецептов (всех, если recipe_ids не
+    задан): колонку search_vector в PostgreSQL, таблицу FTS5 в SQLite.
+    """
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+    if connection.vendor == 'postgresql':
+        recipes.update(search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        unindex_recipes(recipe_ids)
+        sql, params = recipes.order_by().values_list(
+            'id', 'name', 'text').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) {sql}', params)
+
+
+def unindex_recipes(recipe_ids=None):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if recipe_ids is None:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            return
+        ids = list(recipe_ids)
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', ids)
+
+
+def search_recipes(queryset, value):
+    """
+    Рецепты, подходящие под все слова запроса, по убыванию
+    релевантности search_rank, при равной - сначала новые.
+
+    PostgreSQL ищет по search_vector (GIN-индекс, русский стемминг),
+    SQLite - по FTS5, где вместо стемминга слова ищутся как префиксы.
+    """
+    words = WORD.findall(value)
+    if not words:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(' '.join(words), config=SEARCH_CONFIG)
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query))
+    elif connection.vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        table = Recipe._meta.db_table
+        queryset = queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,)
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 2.5, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+            (match,), output_field=FloatField()))
+    else:
+        for word in words:
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(text__icontains=word))
+        queryset = queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
@@ -1,9 +1,17 @@
-import base64
+import binascii
 import uuid
 
+from api_foodgram.feed import backfill_feed, fan_out_recipe
+from api_foodgram.images import (decode_base64, decoded_size, image_variants,
+                                 schedule_variants)
+from api_foodgram.metrics import IMAGE_UPLOAD_BYTES
 from api_foodgram.models import (Basket, FavoriteRecipe, Ingredient,
                                  IngredientsRecipe, Recipe, Tag)
-from django.core.files.base import ContentFile
+from api_foodgram.utils import (change_counter, insert_or_ignore,
+                                update_shopping_lists)
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 from users.models import Subscribe, User
@@ -11,14 +19,29 @@ from users.serializers import CustomUserSerializer
 
 
 class ImageSerializer(serializers.ImageField):
+    default_error_messages = {
+        'too_large': 'Размер картинки больше {max_size} МБ.',
+    }
+
     def to_internal_value(self, data):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
+            size = decoded_size(imgstr)
+            IMAGE_UPLOAD_BYTES.observe(size)
+            if size > max_size:
+                self.fail('too_large', max_size=max_size // 2 ** 20)
             ext = format.split('/')[-1]
-            return ContentFile(
-                base64.b64decode(imgstr), name=uuid.uuid4().hex + "." + ext
-            )
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                data = decode_base64(imgstr, uuid.uuid4().hex + '.' + ext,
+                                     format.split(':')[-1])
+            except binascii.Error:
+                self.fail('invalid_image')
+        else:
+            size = getattr(data, 'size', 0)
+            IMAGE_UPLOAD_BYTES.observe(size)
+            if size > max_size:
+                self.fail('too_large', max_size=max_size // 2 ** 20)
         return super().to_internal_value(data)
 
 
@@ -69,9 +92,7 @@ class IngredientsRecipeSerializer(serializers.ModelSerializer):
 
 
 class IngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientsRecipe
@@ -85,17 +106,28 @@ class RecipeSerializer(serializers.ModelSerializer):
                                               source='recipe_ingredients')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'author', 'ingredients', 'name', 'text',
-            'tags', 'image',
+            'tags', 'image', 'image_variants',
             'cooking_time',
             'is_favorited', 'is_in_shopping_cart'
         )
 
+    def get_image_variants(self, obj):
+        return image_variants(obj, self.context.get('request'))
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'is_author_subscribed'):
+            instance.author.is_subscribed = instance.is_author_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -105,6 +137,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         ).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -114,10 +148,98 @@ class RecipeSerializer(serializers.ModelSerializer):
         ).exists()
 
 
+class RecipeReadSerializer(RecipeSerializer):
+    """
+    Тот же ответ, что у RecipeSerializer, но словарь собирается напрямую
+    из рецепта с подгруженными автором, тегами и ингредиентами, без
+    обхода полей DRF для каждого значения. Включается настройкой
+    RECIPE_FAST_SERIALIZER.
+    """
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        author = instance.author
+        if hasattr(instance, 'is_author_subscribed'):
+            is_subscribed = instance.is_author_subscribed
+        else:
+            is_subscribed = CustomUserSerializer(
+                context=self.context).get_is_subscribed(author)
+        return {
+            'id': instance.id,
+            'author': {
+                'email': author.email,
+                'id': author.id,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': is_subscribed,
+            },
+            'ingredients': [
+                {
+                    'id': line.ingredient.id,
+                    'name': line.ingredient.name,
+                    'measurement_unit': line.ingredient.measurement_unit,
+                    'amount': float(line.amount),
+                }
+                for line in instance.recipe_ingredients.all()
+            ],
+            'name': instance.name,
+            'text': instance.text,
+            'tags': [
+                {'id': tag.id, 'name': tag.name, 'color': tag.color,
+                 'slug': tag.slug}
+                for tag in instance.tags.all()
+            ],
+            'image': file_url(instance.image, request),
+            'image_variants': image_variants(instance, request),
+            'cooking_time': instance.cooking_time,
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+        }
+
+
+def file_url(file, request=None):
+    """Как serializers.ImageField: абсолютный url файла или None."""
+    if not file:
+        return None
+    url = file.url
+    return request.build_absolute_uri(url) if request else url
+
+
+class RecipeMatchSerializer(RecipeSerializer):
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing')
+
+
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_ITEMS
+    )
+
+
 class RecipeHelpSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, obj):
+        return image_variants(obj, self.context.get('request'))
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -150,13 +272,17 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'ingredients': 'выберите ингредиенты'}
             )
-        ingredient_part = []
-        for ingred in ingredients:
-            if ingred in ingredient_part:
-                raise serializers.ValidationError(
-                    {'ingredients': 'данный ингредиен уже добавлен рецепт'}
-                )
-            ingredient_part.append(ingred)
+        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
+        if len(ingredient_ids) != len(set(ingredient_ids)):
+            raise serializers.ValidationError(
+                {'ingredients': 'данный ингредиен уже добавлен рецепт'}
+            )
+        missing = set(ingredient_ids) - set(Ingredient.objects.filter(
+            id__in=ingredient_ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                {'ingredients': f'ингредиенты не найдены: {sorted(missing)}'}
+            )
         return value
 
     def validate_tags(self, value):
@@ -175,31 +301,79 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         ingredients = super().to_representation(instance)
         ingredients['ingredients'] = IngredientsRecipeSerializer(
-            instance.recipe_ingredients.all(), many=True).data
+            instance.recipe_ingredients.select_related('ingredient'),
+            many=True).data
         return ingredients
 
-    def tags_ingredients_create(self, ingredients, tags, model):
-        for ingredient in ingredients:
-            IngredientsRecipe.objects.update_or_create(
-                recipe=model,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount'])
-        model.tags.set(tags)
-
+    def tags_ingredients_save(self, recipe, ingredients, tags, lines=None):
+        """
+        Сохраняет состав и теги рецепта, меняя только то, что изменилось:
+        lines - текущие строки состава {id ингредиента: IngredientsRecipe}.
+        Лишние строки удаляются одним DELETE, изменившиеся количества
+        пишутся одним bulk_update, новые строки - одним bulk_create.
+        """
+        lines = lines or {}
+        amounts = {ingredient['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        removed = lines.keys() - amounts.keys()
+        if removed:
+            IngredientsRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, line in lines.items():
+            if ingredient_id in amounts and line.amount != amounts[
+                    ingredient_id]:
+                line.amount = amounts[ingredient_id]
+                changed.append(line)
+        if changed:
+            IngredientsRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientsRecipe.objects.bulk_create(
+            IngredientsRecipe(recipe=recipe, ingredient_id=ingredient_id,
+                              amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in lines
+        )
+        recipe.tags.set(tags)
+        return amounts
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if isinstance(image, TemporaryUploadedFile):
+                image.close()
+
+    @transaction.atomic
     def create(self, validated_data):
         data_ingredients = validated_data.pop('ingredients')
         data_tags_id = validated_data.pop('tags')
         recipe_create = Recipe.objects.create(**validated_data)
-        self.tags_ingredients_create(data_ingredients,
-                                     data_tags_id, recipe_create)
+        self.tags_ingredients_save(recipe_create, data_ingredients,
+                                   data_tags_id)
+        fan_out_recipe(recipe_create)
+        transaction.on_commit(lambda: schedule_variants(recipe_create))
         return recipe_create
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         data_ingredients = validated_data.pop('ingredients')
         data_tags_id = validated_data.pop('tags')
-        instance.ingredients.clear()
-        instance.tags.clear()
-        self.tags_ingredients_create(data_ingredients, data_tags_id, instance)
+        lines = {line.ingredient_id: line
+                 for line in instance.recipe_ingredients.all()}
+        old_lines = {ingredient_id: line.amount
+                     for ingredient_id, line in lines.items()}
+        new_lines = self.tags_ingredients_save(
+            instance, data_ingredients, data_tags_id, lines)
+        update_shopping_lists(
+            Basket.objects.filter(recipe=instance).values_list(
+                'user_id', flat=True),
+            removed=old_lines,
+            added=new_lines
+        )
+        if 'image' in validated_data:
+            validated_data['image_variants_ready'] = False
+            transaction.on_commit(lambda: schedule_variants(instance))
         return super().update(instance, validated_data)
 
 
@@ -239,31 +413,27 @@ class SubscribeSerializer(serializers.ModelSerializer):
         return RecipeHelpSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def create(self, validated_data):
+        """Повторная подписка - 400 по результату одной вставки, а не
+        IntegrityError при параллельных запросах."""
+        user = self.context['request'].user
         author = get_object_or_404(
             User,
             id=self.context['request'].parser_context['kwargs']['user_id']
         )
-        Subscribe.objects.create(
-            user=self.context['request'].user,
-            author=author
-        )
-        return author
-
-    def validate(self, data):
-        if self.context['request'].method != 'POST':
-            return data
-        author = self.context.get('author')
-        user = self.context.get('request').user
         if user == author:
             raise serializers.ValidationError(
-                'Нельзя подписаться на самого себя')
-        if Subscribe.objects.filter(author=author, user=user).exists():
-            raise serializers.ValidationError(
-                f'Вы уже подписаны на автора {author}.')
-        return data
+                {'errors': 'Нельзя подписаться на самого себя'})
+        with transaction.atomic():
+            if not insert_or_ignore(Subscribe, user=user, author=author):
+                raise serializers.ValidationError(
+                    {'errors': f'Вы уже подписаны на автора {author}.'})
+            backfill_feed(user, author)
+            change_counter(User, author.id, 'followers_count', 1)
+        author.followers_count += 1
+        return author
 
 
 class UserSubscribeRepresentSerializer(serializers.ModelSerializer):
@@ -283,19 +453,23 @@ class UserSubscribeRepresentSerializer(serializers.ModelSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = None
-        if request:
-            recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        recipes = getattr(obj, 'recipe_previews', None)
+        if recipes is None:
+            recipes_limit = None
+            if request:
+                recipes_limit = request.query_params.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if recipes_limit:
+                recipes = obj.recipes.all()[:int(recipes_limit)]
         return RecipeHelpSerializer(recipes, many=True,
                                     context={'request': request}).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -0,0 +1,114 @@
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from users.models import Subscribe, User
+
+from .cache import bump_cache_version, user_flags_namespace
+from .ingredient_index import ingredient_index
+from .models import (Basket, FavoriteRecipe, Ingredient, IngredientsRecipe,
+                     Recipe, Tag)
+from .recipe_index import recipe_index
+from .search import index_recipes, unindex_recipes
+from .utils import change_related_counters
+
+
+def bump_on_commit(*namespaces):
+    """Версия меняется после коммита, иначе параллельный запрос успеет
+    закэшировать старые данные под новой версией."""
+    transaction.on_commit(lambda: bump_cache_version(*namespaces))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    """После коммита, иначе перестройка индекса может успеть прочитать
+    старые данные."""
+    transaction.on_commit(ingredient_index.invalidate)
+    bump_on_commit('ingredients', 'recipes')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientsRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes_cache(**kwargs):
+    bump_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientsRecipe)
+def invalidate_recipe_index(**kwargs):
+    """После коммита, иначе фоновая загрузка может прочитать рецепт
+    без ингредиентов."""
+    transaction.on_commit(recipe_index.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_index(instance, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    index_recipes([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search_index(instance, **kwargs):
+    unindex_recipes([instance.pk])
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags_cache(**kwargs):
+    bump_on_commit('tags', 'recipes')
+
+
+@receiver(post_save, sender=User)
+def invalidate_authors_cache(update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=Basket)
+@receiver((post_save, post_delete), sender=Subscribe)
+def invalidate_user_flags(instance, **kwargs):
+    bump_on_commit(user_flags_namespace(instance.user_id))
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=Basket)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_save, sender=Recipe)
+def count_created(sender, instance, created, raw=False,
+                  counters_changed=False, **kwargs):
+    """
+    Записи, созданные через ORM (админка, создание рецепта), меняют
+    счетчики здесь; вставки API (insert_or_ignore) меняют их сами
+    одним UPDATE на пакет.
+    """
+    if created and not raw and not counters_changed:
+        change_related_counters(sender, instance, 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=Basket)
+@receiver(post_delete, sender=Subscribe)
+@receiver(post_delete, sender=Recipe)
+def count_deleted(sender, instance, counters_changed=False, **kwargs):
+    """То же для удаления через ORM, в том числе каскадного при удалении
+    рецепта или пользователя."""
+    if not counters_changed:
+        change_related_counters(sender, instance, -1)
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """
+    Постоянное соединение (CONN_MAX_AGE), оборванное базой между
+    запросами, закрывается до запроса, а не падает на первом SQL.
+    Проверка - SELECT 1 мимо логирования Django.
+    """
+    for connection in connections.all():
+        if (connection.connection is not None
+                and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
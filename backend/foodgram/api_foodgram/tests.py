@@ -0,0 +1,230 @@
+import io
+
+from api_foodgram.benchmarks import NO_CACHE, bench_user, fire, seed_dataset
+from api_foodgram.models import Basket, FavoriteRecipe, Recipe
+from api_foodgram.renderers import SHOPPING_LIST_RENDERERS
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from users.models import Subscribe, User
+
+RACE_WORKERS = 6
+
+
+@override_settings(CACHES=NO_CACHE)
+class RecipeListQueriesTest(TestCase):
+    """Число SQL-запросов списка рецептов не зависит от размера
+    страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(users=40, recipes=60, ingredients_per_recipe=4)
+        cls.user = bench_user()
+
+    def assert_queries_independent_of_page_size(self, client):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get('/api/recipes/?limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+        with self.assertNumQueries(len(context.captured_queries)):
+            response = client.get('/api/recipes/?limit=50')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_anonymous(self):
+        self.assert_queries_independent_of_page_size(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_queries_independent_of_page_size(client)
+
+    def test_user_flags_loaded_once(self):
+        """Поверх общей страницы - три запроса за избранным, корзиной и
+        подписками, один раз на personal_version() и personalize()."""
+        with CaptureQueriesContext(connection) as context:
+            APIClient().get('/api/recipes/')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertNumQueries(len(context.captured_queries) + 3):
+            client.get('/api/recipes/')
+
+
+class SubscribeTest(TestCase):
+    """Вставка подписки пропускает только повтор, а не нарушение
+    остальных ограничений."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(users=40, recipes=60, ingredients_per_recipe=4)
+        cls.user = bench_user()
+        cls.author = User.objects.exclude(id=cls.user.id).exclude(
+            id__in=Subscribe.objects.filter(user=cls.user).values('author')
+        ).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_self_subscription(self):
+        for url, status in (
+                (f'/api/users/{self.user.id}/subscribe/', 400),
+                ('/api/users/subscriptions/batch/', 200)):
+            with self.subTest(url=url):
+                response = self.client.post(url, {'ids': [self.user.id]},
+                                            format='json')
+                self.assertEqual(response.status_code, status)
+        self.assertFalse(Subscribe.objects.filter(
+            user=self.user, author=self.user).exists())
+
+    def test_repeated_subscription(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(Subscribe.objects.filter(
+            user=self.user, author=self.author).count(), 1)
+
+
+class CountersTest(TestCase):
+    """Счетчики верны после изменений и через API, и через ORM
+    (админка, каскадное удаление)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(users=40, recipes=60, ingredients_per_recipe=4)
+        cls.user = bench_user()
+
+    def assert_consistent(self):
+        call_command('rebuild_counters', verify=True, stdout=io.StringIO())
+
+    def test_orm_changes(self):
+        recipe = Recipe.objects.exclude(id__in=FavoriteRecipe.objects.filter(
+            user=self.user).values('recipe')).first()
+        favorite = FavoriteRecipe.objects.create(user=self.user,
+                                                 recipe=recipe)
+        self.assert_consistent()
+        favorite.delete()
+        self.assert_consistent()
+        recipe.delete()
+        self.assert_consistent()
+        User.objects.exclude(id=self.user.id).first().delete()
+        self.assert_consistent()
+
+    def test_api_changes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        recipe = Recipe.objects.exclude(id__in=FavoriteRecipe.objects.filter(
+            user=self.user).values('recipe')).first()
+        url = f'/api/recipes/{recipe.id}/favorite/'
+        self.assertEqual(client.post(url).status_code, 201)
+        self.assert_consistent()
+        self.assertEqual(client.delete(url).status_code, 204)
+        self.assert_consistent()
+        own = Recipe.objects.filter(author=self.user).first()
+        self.assertEqual(
+            client.delete(f'/api/recipes/{own.id}/').status_code, 204)
+        self.assert_consistent()
+
+    def test_save_keeps_derived_fields(self):
+        recipe = Recipe.objects.first()
+        recipe.name = 'Новое название'
+        with CaptureQueriesContext(connection) as context:
+            recipe.save()
+        update = context.captured_queries[0]['sql']
+        for field in Recipe.derived_fields:
+            self.assertNotIn(field, update)
+
+
+class ShoppingListDownloadTest(TestCase):
+    """Список покупок отдается в запрошенном формате, ошибки - JSON."""
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(users=40, recipes=60, ingredients_per_recipe=4)
+        cls.user = bench_user()
+
+    def test_formats(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for renderer in SHOPPING_LIST_RENDERERS:
+            with self.subTest(format=renderer.format):
+                response = client.get(self.url, {'format': renderer.format})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith(
+                    renderer.media_type))
+                self.assertTrue(b''.join(response.streaming_content))
+
+    def test_errors_as_json(self):
+        for renderer in SHOPPING_LIST_RENDERERS:
+            with self.subTest(format=renderer.format):
+                response = APIClient().get(
+                    self.url, {'format': renderer.format})
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['Content-Type'],
+                                 'application/json')
+                self.assertIn('detail', response.json())
+
+
+class MetricsViewTest(TestCase):
+    """/metrics закрыт, пока не задан METRICS_TOKEN."""
+
+    @override_settings(METRICS_TOKEN='')
+    def test_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_with_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'foodgram_request_duration_seconds', response.content)
+
+
+class ParallelTogglesTest(TransactionTestCase):
+    """
+    Одновременные добавления и удаления избранного, корзины и подписки:
+    проходит ровно один запрос, остальные получают 400, счетчики и
+    списки покупок остаются согласованными.
+    """
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('нужна база с параллельной записью: PostgreSQL '
+                          'или SQLite с файлом тестовой базы')
+        seed_dataset(users=40, recipes=60, ingredients_per_recipe=4)
+        self.user = bench_user()
+
+    def assert_one_wins(self, url):
+        for method, success in (('post', 201), ('delete', 204)):
+            with self.subTest(url=url, method=method):
+                self.assertEqual(
+                    fire(method, url, self.user, RACE_WORKERS),
+                    [success] + [400] * (RACE_WORKERS - 1))
+
+    def assert_consistent(self):
+        call_command('rebuild_counters', verify=True, stdout=io.StringIO())
+        call_command('rebuild_shopping_lists', verify=True,
+                     stdout=io.StringIO())
+
+    def test_favorite(self):
+        recipe = Recipe.objects.exclude(id__in=FavoriteRecipe.objects.filter(
+            user=self.user).values('recipe')).first()
+        self.assert_one_wins(f'/api/recipes/{recipe.id}/favorite/')
+        self.assert_consistent()
+
+    def test_shopping_cart(self):
+        recipe = Recipe.objects.exclude(id__in=Basket.objects.filter(
+            user=self.user).values('recipe')).first()
+        self.assert_one_wins(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assert_consistent()
+
+    def test_subscribe(self):
+        author = User.objects.exclude(id=self.user.id).exclude(
+            id__in=Subscribe.objects.filter(user=self.user).values('author')
+        ).first()
+        self.assert_one_wins(f'/api/users/{author.id}/subscribe/')
+        self.assert_consistent()
@@ -1,24 +1,405 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from datetime import timedelta
 
-from .models import IngredientsRecipe
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (Case, Count, F, FloatField, IntegerField,
+                              OuterRef, Subquery, Sum, UniqueConstraint, Value,
+                              When, Window, sql)
+from django.db.models.functions import Coalesce, RowNumber, TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from users.models import Subscribe, User
 
+from .metrics import SHOPPING_LIST_DURATION, observe_stream
+from .models import (Basket, FavoriteRecipe, IngredientsRecipe, Recipe,
+                     ShoppingListItem)
 
-def get_basket(user):
-    user_basket = user.basket.all()
-    ingredient_amount = IngredientsRecipe.objects.filter(
-        recipe__basket__user=user).values(
+SHOPPING_LIST_CHUNK_SIZE = 500
+# счетчик (модель, поле) -> (модель связанных записей, поле-ссылка на нее)
+COUNTERS = {
+    (Recipe, 'favorites_count'): (FavoriteRecipe, 'recipe'),
+    (Recipe, 'in_carts_count'): (Basket, 'recipe'),
+    (User, 'recipes_count'): (Recipe, 'author'),
+    (User, 'followers_count'): (Subscribe, 'author'),
+}
+
+
+def recipe_lines(recipe):
+    """Состав рецепта: {id ингредиента: количество}."""
+    return dict(IngredientsRecipe.objects.filter(
+        recipe=recipe).values_list('ingredient_id', 'amount'))
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счетчик field записи pk на delta."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def change_counters(model, pks, field, delta):
+    """Как change_counter, но для нескольких записей одним UPDATE."""
+    if pks:
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def change_related_counters(source, instance, delta):
+    """Меняет на delta счетчики (см. COUNTERS), которые считают записи
+    модели source, для записей, на которые ссылается instance."""
+    for (model, field), (counted_model, key) in COUNTERS.items():
+        if counted_model is source:
+            change_counter(model, getattr(instance, f'{key}_id'), field,
+                           delta)
+
+
+def columns(model, names):
+    quote = connection.ops.quote_name
+    return [quote(model._meta.get_field(name).column) for name in names]
+
+
+def insert_statements(model, instances):
+    """
+    SQL INSERT ... ON CONFLICT (поля уникального ограничения model) DO
+    NOTHING для instances: пропускается только повтор записи, нарушение
+    остальных ограничений - IntegrityError, как и без ON CONFLICT.
+    """
+    query = sql.InsertQuery(model)
+    query.insert_values(
+        [field for field in model._meta.concrete_fields
+         if not field.primary_key],
+        instances
+    )
+    unique = next(constraint.fields
+                  for constraint in model._meta.constraints
+                  if isinstance(constraint, UniqueConstraint))
+    target = ', '.join(columns(model, unique))
+    return [(f'{statement} ON CONFLICT ({target}) DO NOTHING', params)
+            for statement, params
+            in query.get_compiler(connection=connection).as_sql()]
+
+
+def delete_statement(model, instance, names, key=None, values=()):
+    """
+    SQL DELETE записей model с теми же значениями полей names, что у
+    instance, а если задан key - еще и со значением key из values
+    (= ANY, только PostgreSQL).
+    """
+    conditions = [f'{column} = %s' for column in columns(model, names)]
+    params = [getattr(instance, model._meta.get_field(name).attname)
+              for name in names]
+    if key is not None:
+        conditions.extend(f'{column} = ANY(%s)'
+                          for column in columns(model, [key]))
+        params.append(list(values))
+    table = connection.ops.quote_name(model._meta.db_table)
+    return f'DELETE FROM {table} WHERE {" AND ".join(conditions)}', params
+
+
+def send_saved(model, instance):
+    """post_save за вставку мимо ORM; счетчики вызывающий код меняет
+    сам, одним UPDATE (counters_changed)."""
+    post_save.send(sender=model, instance=instance, created=True,
+                   update_fields=None, raw=False, using=connection.alias,
+                   counters_changed=True)
+
+
+def send_deleted(model, instance):
+    post_delete.send(sender=model, instance=instance,
+                     using=connection.alias, counters_changed=True)
+
+
+def insert_or_ignore(model, **values):
+    """
+    INSERT ... ON CONFLICT DO NOTHING одним запросом, без гонки между
+    проверкой и вставкой. Возвращает True, если запись добавлена;
+    тогда, как после save(), отправляется post_save - с экземпляром без
+    pk.
+    """
+    instance = model(**values)
+    with connection.cursor() as cursor:
+        for statement, params in insert_statements(model, [instance]):
+            cursor.execute(statement, params)
+        inserted = cursor.rowcount > 0
+    if inserted:
+        send_saved(model, instance)
+    return inserted
+
+
+def delete_rows(model, **filters):
+    """
+    DELETE одним SQL-запросом, без выборки удаляемых записей, которую
+    делает QuerySet.delete(); годится только для таблиц, на которые нет
+    ссылок. Возвращает число удаленных строк и, если они были,
+    отправляет post_delete с экземпляром model(**filters).
+    """
+    instance = model(**filters)
+    with connection.cursor() as cursor:
+        cursor.execute(*delete_statement(model, instance, filters))
+        deleted = cursor.rowcount
+    if deleted:
+        send_deleted(model, instance)
+    return deleted
+
+
+def insert_many_or_ignore(model, key, values, **common):
+    """
+    Добавляет записи model(key=value, **common) для всех values.
+    В PostgreSQL - одним INSERT ... ON CONFLICT DO NOTHING RETURNING,
+    в остальных СУБД - по записи через insert_or_ignore. Возвращает
+    множество values, для которых запись добавлена.
+    """
+    if connection.vendor != 'postgresql':
+        return {value for value in values
+                if insert_or_ignore(model, **{key: value}, **common)}
+    instances = {value: model(**{key: value}, **common) for value in values}
+    if not instances:
+        return set()
+    (statement, params), = insert_statements(model, list(instances.values()))
+    column = connection.ops.quote_name(model._meta.get_field(key).column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{statement} RETURNING {column}', params)
+        inserted = {row[0] for row in cursor.fetchall()}
+    for value in inserted:
+        send_saved(model, instances[value])
+    return inserted
+
+
+def delete_many(model, key, values, **common):
+    """
+    Удаляет записи model(key=value, **common) для всех values.
+    В PostgreSQL - одним DELETE ... RETURNING, в остальных СУБД - по
+    записи через delete_rows. Возвращает множество values удаленных
+    записей.
+    """
+    if connection.vendor != 'postgresql':
+        return {value for value in values
+                if delete_rows(model, **{key: value}, **common)}
+    if not values:
+        return set()
+    statement, params = delete_statement(
+        model, model(**common), common, key, values)
+    column = connection.ops.quote_name(model._meta.get_field(key).column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{statement} RETURNING {column}', params)
+        deleted = {row[0] for row in cursor.fetchall()}
+    for value in deleted:
+        send_deleted(model, model(**{key: value}, **common))
+    return deleted
+
+
+def counted(model, field):
+    """
+    Значения счетчика field модели model, посчитанные заново по
+    связанным записям (см. COUNTERS): queryset с аннотацией actual.
+    """
+    source, key = COUNTERS[model, field]
+    actual = source.objects.filter(**{key: OuterRef('pk')}).order_by(
+    ).values(key).annotate(total=Count('pk')).values('total')
+    return model.objects.annotate(
+        actual=Coalesce(Subquery(actual, output_field=IntegerField()), 0))
+
+
+def shopping_list_deltas(removed, added):
+    """
+    Изменения строк списка покупок при замене состава removed на added:
+    {id ингредиента: (изменение количества, изменение числа рецептов)}.
+    """
+    deltas = {}
+    for ingredient, amount in removed.items():
+        deltas[ingredient] = (-amount, -1)
+    for ingredient, amount in added.items():
+        old_amount, old_count = deltas.get(ingredient, (0, 0))
+        deltas[ingredient] = (old_amount + amount, old_count + 1)
+    return {
+        ingredient: delta for ingredient, delta in deltas.items()
+        if delta != (0, 0)
+    }
+
+
+def recipes_deltas(recipe_ids, sign=1):
+    """
+    Изменения строк списка покупок при добавлении (sign=1) или удалении
+    (sign=-1) сразу нескольких рецептов: одна агрегация по составам.
+    """
+    rows = IngredientsRecipe.objects.filter(
+        recipe_id__in=recipe_ids).values('ingredient_id').annotate(
+        total=Sum('amount'), recipes=Count('recipe_id')).order_by()
+    return {row['ingredient_id']: (sign * row['total'], sign * row['recipes'])
+            for row in rows}
+
+
+@transaction.atomic
+def update_shopping_lists(user_ids, removed=None, added=None, deltas=None):
+    """
+    Инкрементально обновляет списки покупок пользователей user_ids,
+    когда рецепт с составом removed заменяется составом added
+    (добавление в корзину: только added, удаление: только removed),
+    или на готовые изменения deltas (см. recipes_deltas).
+
+    Существующие строки меняются одним UPDATE, недостающие создаются
+    одним bulk_create, опустевшие удаляются. Строки пользователей
+    блокируются на время обновления.
+    """
+    if deltas is None:
+        deltas = shopping_list_deltas(removed or {}, added or {})
+    if not deltas:
+        return
+    user_ids = list(User.objects.select_for_update().filter(
+        id__in=user_ids).order_by('id').values_list('id', flat=True))
+    if not user_ids:
+        return
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    existing = set(items.values_list('user_id', 'ingredient_id'))
+    if existing:
+        items.update(
+            amount=F('amount') + Case(
+                *(When(ingredient_id=ingredient, then=Value(amount))
+                  for ingredient, (amount, _) in deltas.items()),
+                default=Value(0), output_field=FloatField()),
+            recipes_count=F('recipes_count') + Case(
+                *(When(ingredient_id=ingredient, then=Value(count))
+                  for ingredient, (_, count) in deltas.items()),
+                default=Value(0), output_field=IntegerField())
+        )
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient,
+                         amount=amount, recipes_count=count)
+        for user_id in user_ids
+        for ingredient, (amount, count) in deltas.items()
+        if count > 0 and (user_id, ingredient) not in existing
+    )
+    items.filter(recipes_count__lte=0).delete()
+
+
+def calculate_shopping_lists(user_ids=None):
+    """
+    Списки покупок, посчитанные заново по корзинам: строки с полями
+    user, ingredient, amount, recipes_count.
+    """
+    if user_ids is None:
+        lines = IngredientsRecipe.objects.filter(recipe__basket__isnull=False)
+    else:
+        lines = IngredientsRecipe.objects.filter(
+            recipe__basket__user__in=user_ids)
+    return lines.values(
+        user=F('recipe__basket__user'),
+        ingredient_pk=F('ingredient')
+    ).annotate(
+        total=Sum('amount'),
+        recipes=Count('recipe')
+    ).order_by()
+
+
+def shopping_list(user):
+    """
+    Список покупок пользователя одним чтением материализованного
+    агрегата; в каждой строке - общее число рецептов в корзине.
+    """
+    recipes_count = Basket.objects.filter(user=user).order_by().values(
+        'user').annotate(total=Count('pk')).values('total')
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).values(
         'ingredient__name',
-        'ingredient__measurement_unit').annotate(
-        amounts=Sum('amount')
+        'ingredient__measurement_unit',
+        amounts=F('amount'),
+        basket_recipes=Subquery(recipes_count, output_field=IntegerField())
     ).order_by('ingredient__name')
-    basket_text = (
-        'Список покупок.' + '\n'
-        + 'Выбрано рецептов:' + str(user_basket.count()) + '\n')
-    for ingredient in ingredient_amount:
-        basket_text += (
-            f'{ingredient["ingredient__name"]} - '
-            f'{ingredient["amounts"]} '
-            f'{ingredient["ingredient__measurement_unit"]}\n'
+
+
+def stream_shopping_list(user, renderer):
+    ingredients = shopping_list(user).iterator(
+        chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+    first = next(ingredients, None)
+    if first is None:
+        yield from renderer.stream(0, ())
+        return
+
+    def rows():
+        yield first
+        yield from ingredients
+
+    yield from renderer.stream(first['basket_recipes'], rows())
+
+
+def get_basket(user, renderer):
+    """
+    Потоковая выгрузка списка покупок в формате выбранного рендерера:
+    строки читаются курсором частями и сразу отдаются клиенту.
+    """
+    response = StreamingHttpResponse(
+        observe_stream(stream_shopping_list(user, renderer),
+                       SHOPPING_LIST_DURATION.labels(renderer.format)),
+        content_type=(f'{renderer.media_type}; charset={renderer.charset}'
+                      if renderer.charset else renderer.media_type)
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_list.{renderer.format}"')
+    return response
+
+
+def author_recipe_previews(author_ids, limit=None):
+    """
+    Последние рецепты авторов author_ids, не больше limit на автора,
+    одним запросом: {id автора: [рецепты]}.
+
+    Отбор первых limit рецептов делает ROW_NUMBER() по автору, если СУБД
+    поддерживает оконные функции; иначе рецепты авторов выбираются
+    целиком и обрезаются в Python.
+    """
+    previews = {author_id: [] for author_id in author_ids}
+    if not previews:
+        return previews
+    recipes = Recipe.objects.filter(author_id__in=previews).order_by(
+        'author_id', '-pub_date', '-id')
+    if limit is not None and connection.features.supports_over_clause:
+        ranked = recipes.annotate(preview_position=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc())
+        ))
+        sql, params = ranked.query.sql_with_params()
+        position = connection.ops.quote_name('preview_position')
+        author = connection.ops.quote_name('author_id')
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE {position} <= %s '
+            f'ORDER BY {author}, {position}',
+            (*params, limit)
         )
-    return HttpResponse(basket_text, content_type='text/plain')
+    for recipe in recipes:
+        if limit is None or len(previews[recipe.author_id]) < limit:
+            previews[recipe.author_id].append(recipe)
+    return previews
+
+
+def calculate_recipe_scores(now=None):
+    """
+    Рейтинги рецептов: {id рецепта: (popular, trending)}.
+
+    popular берется из счетчиков избранного и корзин. Для trending
+    добавления за последние RECIPE_TRENDING_DAYS дней считаются в базе
+    по дням, а затухание 0.5 ** (возраст / RECIPE_TRENDING_HALF_LIFE)
+    применяется к дневным суммам, так что читается не больше строк, чем
+    пар (рецепт, день).
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    weight = settings.RECIPE_CART_WEIGHT
+    scores = {
+        pk: [favorites + weight * carts, 0.0]
+        for pk, favorites, carts in Recipe.objects.values_list(
+            'id', 'favorites_count', 'in_carts_count').iterator()
+    }
+    since = now - timedelta(days=settings.RECIPE_TRENDING_DAYS)
+    for model, model_weight in ((FavoriteRecipe, 1.0), (Basket, weight)):
+        rows = model.objects.filter(created__gte=since).values(
+            'recipe_id', day=TruncDate('created')
+        ).annotate(total=Count('pk')).order_by()
+        for row in rows:
+            if row['recipe_id'] not in scores:
+                continue
+            age = max((today - row['day']).days, 0)
+            scores[row['recipe_id']][1] += (
+                model_weight * row['total']
+                * 0.5 ** (age / settings.RECIPE_TRENDING_HALF_LIFE))
+    return {pk: tuple(score) for pk, score in scores.items()}
@@ -1,13 +1,29 @@
+from api_foodgram.cache import CachedResponseMixin, user_flags
+from api_foodgram.feed import (backfill_feeds, drop_author, drop_authors,
+                               feed_recipe_ids)
 from api_foodgram.filters import IngredientSearchFilter, RecipeFilter
+from api_foodgram.ingredient_index import ingredient_index
 from api_foodgram.models import Basket, FavoriteRecipe, Ingredient, Recipe, Tag
 from api_foodgram.pagination import PagePagination
 from api_foodgram.permissions import AuthorAdminOrReadOnly, SubscribeUser
-from api_foodgram.serializers import (IngredientSerializer,
-                                      RecipeCreateSerializer,
-                                      RecipeHelpSerializer, RecipeSerializer,
+from api_foodgram.recipe_index import recipe_index
+from api_foodgram.renderers import SHOPPING_LIST_RENDERERS
+from api_foodgram.serializers import (BatchSerializer, IngredientSerializer,
+                                      PantrySerializer, RecipeCreateSerializer,
+                                      RecipeHelpSerializer,
+                                      RecipeMatchSerializer,
+                                      RecipeReadSerializer, RecipeSerializer,
                                       SubscribeSerializer, TagSerializer,
                                       UserSubscribeRepresentSerializer)
-from api_foodgram.utils import get_basket
+from api_foodgram.utils import (author_recipe_previews, change_counter,
+                                change_counters, delete_many, delete_rows,
+                                get_basket, insert_many_or_ignore,
+                                insert_or_ignore, recipe_lines, recipes_deltas,
+                                update_shopping_lists)
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import BooleanField, Value
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, permissions, status, viewsets
@@ -28,7 +44,8 @@ class CreateDeleteModelViewSet(
     pass
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'ingredients'
     permission_classes = (permissions.AllowAny,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -36,75 +53,265 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (IngredientSearchFilter,)
     search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(IngredientSearchFilter.search_param)
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        return Response(ingredient_index.search(name, limit))
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+
+class RecipeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_namespace = 'recipes'
     permission_classes = (AuthorAdminOrReadOnly,)
     pagination_class = PagePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    rankings = ('popular', 'trending')
+    personal_filters = ('is_favorited', 'is_in_shopping_cart')
+
+    def get_queryset(self):
+        user = AnonymousUser() if self.shared_response else self.request.user
+        queryset = Recipe.objects.with_related().with_user_flags(user)
+        ranking = self.ranking()
+        if not ranking:
+            return queryset
+        return queryset.filter(score__isnull=False).order_by(
+            f'-score__{ranking}', '-id')
+
+    def ranking(self):
+        """Лента ?ordering=popular|trending читается из RecipeScore."""
+        ordering = self.request.query_params.get('ordering')
+        return ordering if ordering in self.rankings else None
+
+    @property
+    def keyset_ordering(self):
+        """Ленты по рейтингу, результаты поиска и подбор по ингредиентам
+        листаются только по номеру страницы."""
+        if (self.ranking() or self.request.query_params.get('search')
+                or self.action == 'what_to_cook'):
+            return None
+        return ('-pub_date', '-id')
+
+    def is_cacheable(self, request):
+        """Общий ответ не годится только для выборок по избранному и
+        корзине текущего пользователя."""
+        return request.user.is_anonymous or not any(
+            request.query_params.get(name, '0') not in ('', '0')
+            for name in self.personal_filters
+        )
+
+    def personal_version(self, request):
+        if request.user.is_anonymous:
+            return 0
+        return user_flags(request)['version']
+
+    def personalize(self, request, data):
+        """Проставляет is_favorited, is_in_shopping_cart и
+        author.is_subscribed в копии общего ответа."""
+        if request.user.is_anonymous:
+            return data
+        flags = user_flags(request)
+
+        def overlay(recipe):
+            return {
+                **recipe,
+                'is_favorited': recipe['id'] in flags['favorites'],
+                'is_in_shopping_cart': recipe['id'] in flags['cart'],
+                'author': {
+                    **recipe['author'],
+                    'is_subscribed': (recipe['author']['id']
+                                      in flags['subscriptions']),
+                },
+            }
+
+        if isinstance(data, list):
+            return [overlay(recipe) for recipe in data]
+        if 'results' in data:
+            return {**data, 'results': [overlay(recipe)
+                                        for recipe in data['results']]}
+        return overlay(data)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
+            if settings.RECIPE_FAST_SERIALIZER:
+                return RecipeReadSerializer
             return RecipeSerializer
         return RecipeCreateSerializer
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        update_shopping_lists(
+            Basket.objects.filter(recipe=instance).values_list(
+                'user_id', flat=True),
+            removed=recipe_lines(instance)
+        )
+        instance.delete()
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[permissions.IsAuthenticated])
     def shopping_cart(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe,
-                                   id=self.kwargs.get('pk'))
         user = self.request.user
-        basket_recipe = Basket.objects.filter(user=user,
-                                              recipe=recipe).exists()
         if request.method == 'POST':
-            if basket_recipe:
-                message = f'{recipe.name} уже добавлен в список покупок'
-                return Response({'errors': message})
-            Basket.objects.create(user=user, recipe=recipe)
+            recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
+            with transaction.atomic():
+                if not insert_or_ignore(Basket, user=user, recipe=recipe):
+                    message = f'{recipe.name} уже добавлен в список покупок'
+                    return Response({'errors': message},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                change_counter(Recipe, recipe.id, 'in_carts_count', 1)
+                update_shopping_lists([user.id], added=recipe_lines(recipe))
             serializer = RecipeHelpSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not basket_recipe:
-            message = f'{recipe.name} не найден'
-            return Response({'errors': message},
-                            status=status.HTTP_404_NOT_FOUND)
-        Basket.objects.get(user=user,
-                           recipe=recipe).delete()
+        with transaction.atomic():
+            if not delete_rows(Basket, user=user,
+                               recipe_id=self.kwargs.get('pk')):
+                return self.not_in_list('не найден в списке покупок')
+            change_counter(Recipe, self.kwargs.get('pk'), 'in_carts_count',
+                           -1)
+            update_shopping_lists(
+                [user.id], removed=recipe_lines(self.kwargs.get('pk')))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        """Добавление и удаление списка рецептов ids в корзине."""
+        user = request.user
+
+        def update_lists(recipe_ids, delta):
+            update_shopping_lists(
+                [user.id], deltas=recipes_deltas(recipe_ids, delta))
+
+        return self.toggle_batch(request, Basket, 'in_carts_count',
+                                 update_lists)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_batch(self, request):
+        """Добавление и удаление списка рецептов ids в избранном."""
+        return self.toggle_batch(request, FavoriteRecipe, 'favorites_count')
+
+    def toggle_batch(self, request, model, counter, on_change=None):
+        """
+        Рецепты проверяются одним запросом, записи добавляются (POST) или
+        удаляются (DELETE) одним запросом, счетчики меняются одним UPDATE.
+        В ответе - результат для каждого id: added/exists или
+        removed/absent, not_found для несуществующих рецептов.
+        """
+        batch = BatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(batch.validated_data['ids']))
+        found = set(Recipe.objects.filter(id__in=ids).values_list(
+            'id', flat=True))
+        if request.method == 'POST':
+            write, delta, labels = insert_many_or_ignore, 1, (
+                'added', 'exists')
+        else:
+            write, delta, labels = delete_many, -1, ('removed', 'absent')
+        with transaction.atomic():
+            changed = write(model, 'recipe_id', found, user=request.user)
+            change_counters(Recipe, changed, counter, delta)
+            if changed and on_change is not None:
+                on_change(changed, delta)
+        return Response({'results': batch_results(ids, found, changed,
+                                                  labels)})
+
+    def not_in_list(self, reason):
+        """Ответ на удаление рецепта, которого нет в избранном или
+        корзине: 404, если нет самого рецепта, иначе 400."""
+        recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
+        return Response({'errors': f'{recipe.name} {reason}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        """Рецепты авторов из подписок пользователя, новые сверху."""
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            id__in=feed_recipe_ids(request.user))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False,
+            methods=['post'],
+            permission_classes=[permissions.AllowAny])
+    def what_to_cook(self, request):
+        """Рецепты по имеющимся ингредиентам: сначала те, для которых
+        есть большая доля ингредиентов."""
+        pantry = PantrySerializer(data=request.data)
+        pantry.is_valid(raise_exception=True)
+        matches = self.paginate_queryset(recipe_index.match(
+            pantry.validated_data['ingredients'],
+            pantry.validated_data.get('max_missing')
+        ))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches])
+        page = []
+        for recipe_id, coverage, missing in matches:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage, recipe.missing = coverage, missing
+                page.append(recipe)
+        serializer = RecipeMatchSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
-        return get_basket(self.request.user)
+        return get_basket(self.request.user, request.accepted_renderer)
 
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[permissions.IsAuthenticated])
     def favorite(self, request, *args, **kwargs):
-        recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
         user = self.request.user
-        fav_recipe = FavoriteRecipe.objects.filter(user=user,
-                                                   recipe=recipe).exists()
         if request.method == 'POST':
-            if fav_recipe:
-                message = f'{recipe.name} уже добавлен в избранное'
-                return Response({'errors': message})
-            FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            recipe = get_object_or_404(Recipe, id=self.kwargs.get('pk'))
+            with transaction.atomic():
+                if not insert_or_ignore(FavoriteRecipe, user=user,
+                                        recipe=recipe):
+                    message = f'{recipe.name} уже добавлен в избранное'
+                    return Response({'errors': message},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                change_counter(Recipe, recipe.id, 'favorites_count', 1)
             serializer = RecipeHelpSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not fav_recipe:
-            message = f'{recipe.name} не найден'
-            return Response({'errors': message},
-                            status=status.HTTP_404_NOT_FOUND)
-        FavoriteRecipe.objects.get(user=user,
-                                   recipe=recipe).delete()
+        with transaction.atomic():
+            if not delete_rows(FavoriteRecipe, user=user,
+                               recipe_id=self.kwargs.get('pk')):
+                return self.not_in_list('не найден в избранном')
+            change_counter(Recipe, self.kwargs.get('pk'), 'favorites_count',
+                           -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+def batch_results(ids, found, changed, labels):
+    """Результат пакетной операции для каждого id в порядке запроса."""
+    return [
+        {'id': pk,
+         'status': ('not_found' if pk not in found
+                    else labels[0] if pk in changed else labels[1])}
+        for pk in ids
+    ]
+
+
+class TagViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'tags'
     permission_classes = (permissions.AllowAny,)
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -115,9 +322,54 @@ class SubscriptionsViewSet(mixins.ListModelMixin,
     serializer_class = UserSubscribeRepresentSerializer
     pagination_class = PagePagination
     permission_classes = (permissions.IsAuthenticated,)
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return User.objects.filter(subscibe__user=self.request.user)
+        return User.objects.filter(subscibe__user=self.request.user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()))
+
+    def paginate_queryset(self, queryset):
+        """Превью рецептов всех авторов страницы - одним запросом."""
+        authors = super().paginate_queryset(queryset)
+        if authors is None:
+            return None
+        limit = self.request.query_params.get('recipes_limit', '')
+        previews = author_recipe_previews(
+            [author.id for author in authors],
+            int(limit) if limit.isdigit() else None
+        )
+        for author in authors:
+            author.recipe_previews = previews[author.id]
+        return authors
+
+    @action(detail=False, methods=['post', 'delete'])
+    def batch(self, request):
+        """
+        Подписка (POST) и отписка (DELETE) сразу от списка авторов ids:
+        авторы проверяются одним запросом, подписки пишутся одним
+        запросом. Подписаться на себя нельзя - для своего id not_found.
+        """
+        user = request.user
+        batch = BatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(batch.validated_data['ids']))
+        authors = User.objects.exclude(id=user.id).in_bulk(ids)
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = insert_many_or_ignore(
+                    Subscribe, 'author_id', set(authors), user=user)
+                backfill_feeds(
+                    user, [authors[author_id] for author_id in changed])
+                change_counters(User, changed, 'followers_count', 1)
+                labels = ('added', 'exists')
+            else:
+                changed = delete_many(
+                    Subscribe, 'author_id', set(authors), user=user)
+                drop_authors(user, changed)
+                change_counters(User, changed, 'followers_count', -1)
+                labels = ('removed', 'absent')
+        return Response({'results': batch_results(ids, authors, changed,
+                                                  labels)})
 
 
 class SubscribeViewSet(viewsets.ModelViewSet):
@@ -130,17 +382,13 @@ class SubscribeViewSet(viewsets.ModelViewSet):
         )
 
     def delete(self, request, user_id, format=None):
-        unsubs = get_object_or_404(User, id=user_id)
-        try:
-            subscribe = get_object_or_404(
-                Subscribe,
-                user=self.request.user,
-                author=unsubs
-            )
-
-        except status.HTTP_404_NOT_FOUND:
-            message = f'Автор {unsubs} отсутствут в Ваших подписках.'
-            return Response(
-                {'errors': message})
-        subscribe.delete()
-        return Response(status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            if not delete_rows(Subscribe, user=self.request.user,
+                               author_id=user_id):
+                unsubs = get_object_or_404(User, id=user_id)
+                message = f'Автор {unsubs} отсутствут в Ваших подписках.'
+                return Response({'errors': message},
+                                status=status.HTTP_400_BAD_REQUEST)
+            drop_author(self.request.user, user_id)
+            change_counter(User, user_id, 'followers_count', -1)
+        return Response(status=status.HTTP_204_NO_CONTENT)
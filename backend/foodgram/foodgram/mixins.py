@@ -0,0 +1,17 @@
+class DerivedFieldsMixin:
+    """
+    Поля derived_fields (счетчики, поисковый индекс) пишутся только
+    UPDATE: счетчики - с F-выражением, индекс - пересчетом из других
+    полей. save() уже существующей записи их не перезаписывает
+    прочитанными ранее значениями.
+    """
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
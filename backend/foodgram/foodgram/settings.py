@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -30,6 +31,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api_foodgram.middleware.MetricsMiddleware',
+    'api_foodgram.middleware.ProfilingMiddleware',
+    'api_foodgram.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,12 +64,21 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
-"""Настройка кэш """
+"""Настройка кэш
+
+Кэш ответов API и версии его ключей должны быть общими для всех воркеров
+gunicorn, поэтому по умолчанию кэш файловый.
+"""
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='/tmp/foodgram_cache'),
     }
 }
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=600))
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.sqlite3',
@@ -83,9 +96,30 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgreasql'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgreasql'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default='1111')
+        'PORT': os.getenv('DB_PORT', default='1111'),
+        # соединение живет между запросами воркера DB_CONN_MAX_AGE секунд
+        # (0 - новое на каждый запрос) и проверяется перед запросом
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS',
+                                        default='True') == 'True',
+        # пул на DB_POOL_SIZE соединений на процесс для потоковых воркеров
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', default=0)),
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=10)),
     }
 }
+if (DATABASES['default']['POOL_SIZE']
+        and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'):
+    DATABASES['default']['ENGINE'] = 'api_foodgram.db'
+    # соединение возвращается в пул в конце каждого запроса
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # тестовая база в файле, а не в памяти: иначе тесты одновременных
+    # запросов (ParallelTogglesTest) пропускаются
+    DATABASES['default']['TEST'] = {'NAME': os.getenv(
+        'DB_TEST_NAME',
+        default=os.path.join(tempfile.gettempdir(), 'foodgram_test.sqlite3')
+    )}
+    DATABASES['default']['OPTIONS'] = {'timeout': 30}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -133,6 +167,11 @@ MESSAGE_USERNAME_EXISTS = 'This name is already taken'
 
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api_foodgram.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
@@ -164,3 +203,66 @@ LENG_LAST_NAME = 150
 LENG_CHARFIELD = 200
 LENG_HEX = 7
 PAGE_SIZE = 6
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', default=300))
+
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE',
+                                      default=5 * 2 ** 20))
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS',
+                                         default=2))
+
+RECIPE_CART_WEIGHT = float(os.getenv('RECIPE_CART_WEIGHT', default=0.5))
+RECIPE_TRENDING_DAYS = int(os.getenv('RECIPE_TRENDING_DAYS', default=14))
+RECIPE_TRENDING_HALF_LIFE = float(os.getenv('RECIPE_TRENDING_HALF_LIFE',
+                                            default=3))
+
+FEED_INBOX_LENGTH = int(os.getenv('FEED_INBOX_LENGTH', default=500))
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=10000))
+
+RECIPE_INDEX_TTL = int(os.getenv('RECIPE_INDEX_TTL', default=300))
+PANTRY_MAX_INGREDIENTS = int(os.getenv('PANTRY_MAX_INGREDIENTS',
+                                       default=200))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', default=100))
+
+RECIPE_FAST_SERIALIZER = os.getenv('RECIPE_FAST_SERIALIZER',
+                                   default='True') == 'True'
+
+JSON_RENDERER = os.getenv('JSON_RENDERER', default='orjson')
+RESPONSE_GZIP_MIN_LENGTH = int(os.getenv('RESPONSE_GZIP_MIN_LENGTH',
+                                         default=1024))
+
+SQL_PROFILING = os.getenv('SQL_PROFILING', default='False') == 'True'
+SQL_PROFILING_TOKEN = os.getenv('SQL_PROFILING_TOKEN', default='')
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', default=500))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', default=100))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'profiling': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'api_foodgram.profiling': {
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+# каталог файлов метрик воркеров: задается gunicorn.conf.py, вне gunicorn
+# пуст, и метрики берутся из реестра процесса
+METRICS_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', default='')
@@ -1,3 +1,4 @@
+from api_foodgram.metrics import metrics_view
 from django.contrib import admin
 from django.urls import include, path
 
@@ -6,4 +7,5 @@ app_name = 'foodgram'
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api_foodgram.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
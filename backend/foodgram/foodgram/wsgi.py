@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+from api_foodgram.ingredient_index import ingredient_index  # noqa: E402
+from api_foodgram.recipe_index import recipe_index  # noqa: E402
+
+ingredient_index.warm_up()
+recipe_index.warm_up()
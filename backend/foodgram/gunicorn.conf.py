@@ -0,0 +1,18 @@
+import os
+import shutil
+
+# метрики воркеров пишутся в файлы этого каталога и собираются в /metrics;
+# переменная должна быть задана до импорта prometheus_client
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    '/tmp/foodgram-metrics')
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.19 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_auto_20230604_1539'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscribe',
+            index=models.Index(fields=['user', 'author'], name='subscribe_user_author_idx'),
+        ),
+    ]
@@ -2,9 +2,10 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from foodgram.mixins import DerivedFieldsMixin
 
 
-class User(AbstractUser):
+class User(DerivedFieldsMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     email = models.EmailField(
         validators=(UnicodeUsernameValidator(),),
@@ -47,7 +48,19 @@ class User(AbstractUser):
         verbose_name='Фамилия',
     )
 
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False
+    )
+
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
+    derived_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -91,6 +104,10 @@ class Subscribe(models.Model):
                 name='\nNo self sibscription\n'
             )
         )
+        indexes = (
+            models.Index(fields=('user', 'author'),
+                         name='subscribe_user_author_idx'),
+        )
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'